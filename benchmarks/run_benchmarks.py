@@ -0,0 +1,247 @@
+'''
+Benchmarks for the hot paths of DeepHyperNEAT: CPPN creation, decoding,
+substrate activation, speciation and reproduction.
+
+Every benchmark seeds the random number generators before building its
+inputs, so runs on different commits time the same work (as long as the
+mutation operators draw random numbers the same way). Results are
+written as JSON, and a previous results file can be passed with --compare
+to print the speedup of each benchmark.
+
+The import benchmark times importing the core modules in a fresh
+interpreter, and the script exits with an error if any of them loads a
+plotting library.
+
+Run from the repository root:
+	python benchmarks/run_benchmarks.py --output results.json
+	python benchmarks/run_benchmarks.py --compare results.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from deep_hyperneat.genome import Genome
+from deep_hyperneat.phenomes import FeedForwardCPPN as CPPN
+from deep_hyperneat.decode import decode
+from deep_hyperneat.species import SpeciesSet
+from deep_hyperneat.reproduction import Reproduction
+
+seed = 1
+# Genome sizes, as numbers of mutations applied to a minimal genome
+genome_sizes = {'small':5, 'medium':25, 'large':75}
+# (input_dimensions, sheet_dimensions) pairs decoded by the decode sweep
+decode_dimensions = [([1,2],[1,3]), ([3,3],[3,3]), ([5,5],[5,5]), ([8,8],[8,8])]
+output_dimensions = 1
+population_sizes = [50, 150, 500]
+# Modules timed by the import benchmark, which also checks that importing
+#	them does not load any of the plotting libraries
+import_modules = ['deep_hyperneat.population', 'deep_hyperneat.parallel', 'deep_hyperneat.tasks']
+plotting_modules = ['matplotlib', 'seaborn', 'graphviz']
+import_script = '''
+import sys, json, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {plotting!r} if m in sys.modules]]))
+'''
+
+def seed_all(offset=0):
+	random.seed(seed + offset)
+	np.random.seed(seed + offset)
+
+def evolved_genome(num_mutations, key=0):
+	'''
+	Returns a genome grown from a minimal genome by a fixed sequence of
+	mutations, including at least one hidden substrate layer.
+
+	num_mutations -- number of mutations to apply
+	key 		  -- genome key
+	'''
+	genome = Genome(key)
+	genome.output_keys = list(genome.output_keys)
+	genome.mutate_increment_depth()
+	for _ in range(num_mutations):
+		genome.mutate()
+	return genome
+
+def evolved_population(size, num_mutations=10):
+	'''
+	Returns a population of related genomes, each cloned from an earlier
+	member and mutated.
+
+	size 		  -- number of genomes
+	num_mutations -- number of mutations applied to the founding genome
+	'''
+	population = {1: evolved_genome(num_mutations, 1)}
+	for key in range(2, size+1):
+		parent = population[random.randint(1, key-1)]
+		child = parent.clone(key)
+		child.mutate()
+		population[key] = child
+	return population
+
+def measure(function, setup=None, repeat=5, number=1):
+	'''
+	Times a function and returns the min, median and mean seconds per call.
+
+	function -- function taking the value returned by setup
+	setup    -- optional function called before each repetition, excluded
+				from the timing
+	repeat   -- number of timed repetitions
+	number   -- number of calls per repetition
+	'''
+	times = []
+	for _ in range(repeat):
+		state = setup() if setup is not None else None
+		start = time.perf_counter()
+		for _ in range(number):
+			function(state)
+		times.append((time.perf_counter() - start)/number)
+	return {'min':min(times), 'median':float(np.median(times)), 'mean':float(np.mean(times)),
+			'repeat':repeat, 'number':number}
+
+def bench_cppn_create(repeat):
+	for size, num_mutations in genome_sizes.items():
+		seed_all()
+		genome = evolved_genome(num_mutations)
+		timing = measure(lambda _: CPPN.create(genome), repeat=repeat, number=20)
+		# Genome sizes are reported but not part of the params, since they
+		#	change whenever the mutation operators do
+		timing['nodes'], timing['connections'] = len(genome.nodes), len(genome.connections)
+		yield ('cppn_create', {'genome':size}, timing)
+
+def bench_decode(repeat):
+	seed_all()
+	genome = evolved_genome(genome_sizes['medium'])
+	cppn = CPPN.create(genome)
+	for input_dimensions, sheet_dimensions in decode_dimensions:
+		yield ('decode', {'input_dimensions':input_dimensions, 'sheet_dimensions':sheet_dimensions},
+			   measure(lambda _: decode(cppn, input_dimensions, output_dimensions, sheet_dimensions),
+					   repeat=repeat, number=5))
+
+def bench_activate(repeat):
+	seed_all()
+	genome = evolved_genome(genome_sizes['medium'])
+	cppn = CPPN.create(genome)
+	for input_dimensions, sheet_dimensions in decode_dimensions:
+		substrate = decode(cppn, input_dimensions, output_dimensions, sheet_dimensions)
+		num_inputs = input_dimensions[0]*input_dimensions[1]
+		inputs = tuple(np.random.uniform(-1, 1, num_inputs).tolist()) + (1.0,)
+		batch = np.random.uniform(-1, 1, (256, num_inputs+1))
+		batch[:, -1] = 1.0
+		params = {'input_dimensions':input_dimensions, 'sheet_dimensions':sheet_dimensions}
+		yield ('substrate_activate', params,
+			   measure(lambda _: substrate.activate(inputs), repeat=repeat, number=20))
+		yield ('substrate_activate_batch', dict(params, batch_size=len(batch)),
+			   measure(lambda _: substrate.activate_batch(batch), repeat=repeat, number=5))
+
+def bench_speciate(repeat):
+	for size in population_sizes:
+		seed_all()
+		population = evolved_population(size)
+		# A fresh species set each repetition, so no distances are cached
+		yield ('speciate', {'population_size':size},
+			   measure(lambda species_set: species_set.speciate(population, 0),
+					   setup=lambda: SpeciesSet(3.5), repeat=repeat))
+
+def bench_reproduce(repeat):
+	for size in population_sizes:
+		seed_all()
+		population = evolved_population(size)
+		for genome in population.values():
+			genome.fitness = random.random()
+		def setup():
+			seed_all(1)
+			species_set = SpeciesSet(3.5)
+			species_set.speciate(population, 0)
+			return Reproduction(), species_set
+		yield ('reproduce_with_species', {'population_size':size},
+			   measure(lambda state: state[0].reproduce_with_species(state[1], size, 1),
+					   setup=setup, repeat=repeat))
+
+def bench_import(repeat):
+	root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+	for module in import_modules:
+		script = import_script.format(root=root, module=module, plotting=plotting_modules)
+		times, loaded = [], set()
+		# Each repetition imports into a fresh interpreter
+		for _ in range(repeat):
+			elapsed, plotting = json.loads(subprocess.check_output([sys.executable, '-c', script]))
+			times.append(elapsed)
+			loaded.update(plotting)
+		yield ('import', {'module':module},
+			   {'min':min(times), 'median':float(np.median(times)), 'mean':float(np.mean(times)),
+				'repeat':repeat, 'number':1, 'plotting_modules':sorted(loaded)})
+
+benchmarks = {
+	'import': bench_import,
+	'cppn_create': bench_cppn_create,
+	'decode': bench_decode,
+	'activate': bench_activate,
+	'speciate': bench_speciate,
+	'reproduce': bench_reproduce,
+}
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+									   cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def result_key(result):
+	return result['name'], json.dumps(result['params'], sort_keys=True)
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument('--output', help='file to write the results to as JSON')
+	parser.add_argument('--compare', help='results file of an earlier run to compare against')
+	parser.add_argument('--repeat', type=int, default=5, help='timed repetitions per benchmark')
+	parser.add_argument('--only', nargs='+', choices=sorted(benchmarks),
+						help='benchmark groups to run (default: all)')
+	args = parser.parse_args()
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = {result_key(r): r for r in json.load(f)['results']}
+
+	results = []
+	failures = []
+	for group in args.only or list(benchmarks):
+		for name, params, timing in benchmarks[group](args.repeat):
+			result = dict({'name':name, 'params':params}, **timing)
+			results.append(result)
+			line = "{:<26} {:<60} {:>10.3f} ms".format(name, json.dumps(params), timing['median']*1e3)
+			previous = baseline.get(result_key(result))
+			if previous is not None:
+				line += "  {:>6.2f}x".format(previous['median']/timing['median'])
+			print(line)
+			if timing.get('plotting_modules'):
+				failures.append("importing {0} loads {1}".format(params['module'],
+								", ".join(timing['plotting_modules'])))
+
+	if args.output:
+		report = {'commit':git_commit(), 'python':platform.python_version(),
+				  'numpy':np.__version__, 'platform':platform.platform(),
+				  'seed':seed, 'repeat':args.repeat, 'results':results}
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=1)
+
+	# Importing the core package must stay free of the plotting libraries
+	for failure in failures:
+		print("FAILED: " + failure)
+	if failures:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -56,10 +56,78 @@ def exp_activation(x):
 def linear_activation(x):
     return x
 
+# Vectorized versions of the activation functions. Each takes and returns
+# numpy arrays and clamps exactly like its scalar counterpart above.
+
+def np_sigmoid_activation(x):
+    with np.errstate(over='ignore'):
+        return 1 / (1+np.exp(-x))
+
+def np_tanh_activation(x):
+    return np.tanh(x)
+
+def np_sin_activation(x):
+    return np.sin(x)
+
+def np_tan_activation(z):
+    return np.tan(z)
+
+def np_cos_activation(z):
+    return np.cos(z)
+
+def np_gauss_activation(z):
+    z = np.clip(z, -3.4, 3.4)
+    return np.exp(-5.0 * z**2)
+
+def np_sharp_gauss_activation(x):
+    return np.exp(-100.0 * x**2)
+
+def np_sharp_gauss_mu_2_activation(x):
+    return np.exp(-100.0 * (x-2)**2)
+
+def np_relu_activation(x):
+    return np.where(x > 0.0, x, 0.0)
+
+def np_linear_activation(x):
+    return np.asarray(x, dtype=float)
+
+# Built-in scalar activation functions mapped to their vectorized versions.
+#   Functions registered on an ActivationFunctionSet are kept on that set.
+vectorized_versions = {
+    sigmoid_activation: np_sigmoid_activation,
+    tanh_activation: np_tanh_activation,
+    sin_activation: np_sin_activation,
+    tan_activation: np_tan_activation,
+    cos_activation: np_cos_activation,
+    gauss_activation: np_gauss_activation,
+    sharp_gauss_activation: np_sharp_gauss_activation,
+    sharp_gauss_mu_2_activation: np_sharp_gauss_mu_2_activation,
+    relu_activation: np_relu_activation,
+    linear_activation: np_linear_activation,
+}
+
+def vectorized(function):
+    '''
+    Returns the vectorized version of a built-in scalar activation function.
+    Other functions are wrapped with numpy.vectorize; use
+    ActivationFunctionSet.vectorized() for functions registered on a set.
+
+    function -- scalar activation function
+    '''
+    vectorized_function = vectorized_versions.get(function)
+    if vectorized_function is None:
+        vectorized_function = np.vectorize(function, otypes=[float])
+    return vectorized_function
+
 class InvalidActivationFunction(TypeError):
     pass
 
-def validate_activation(function):
+# Points at which scalar and vectorized versions are compared
+validation_points = np.linspace(-5.0, 5.0, 41)
+# (scalar, vectorized) pairs that have already been validated
+validated_pairs = set()
+
+def validate_activation(function, vectorized_function=None):
     if not isinstance(function,
                       (types.BuiltinFunctionType,
                        types.FunctionType,
@@ -67,6 +135,23 @@ def validate_activation(function):
         raise InvalidActivationFunction("A function object is required.")
     if function.__code__.co_argcount != 1: # avoid deprecated use of `inspect`
         raise InvalidActivationFunction("A single-argument function is required.")
+    if vectorized_function is None or (function, vectorized_function) in validated_pairs:
+        return
+    if not callable(vectorized_function):
+        raise InvalidActivationFunction("A callable vectorized function is required.")
+    # Both versions must agree wherever the scalar version is defined
+    points, expected = [], []
+    for x in validation_points:
+        try:
+            expected.append(function(float(x)))
+        except (ValueError, OverflowError, ZeroDivisionError):
+            continue
+        points.append(x)
+    actual = np.asarray(vectorized_function(np.array(points)), dtype=float)
+    if actual.shape != (len(points),) or not np.allclose(actual, expected, rtol=1e-9, atol=1e-12):
+        raise InvalidActivationFunction(
+            "Vectorized version of {0!r} disagrees with the scalar version.".format(function.__name__))
+    validated_pairs.add((function, vectorized_function))
 
 class ActivationFunctionSet(object):
     """
@@ -75,6 +160,13 @@ class ActivationFunctionSet(object):
     """
     def __init__(self):
         self.functions = {}
+        self.vectorized_functions = {}
+        # Scalar functions of this set mapped to their vectorized versions
+        self.vectorized_versions = {}
+        # Integer registry ids, assigned in registration order
+        self.ids = {}
+        self.id_functions = []
+        self.function_ids = {}
         self.add('sigmoid', sigmoid_activation)
         self.add('sin', sin_activation)
         self.add('cos', cos_activation)
@@ -84,12 +176,65 @@ class ActivationFunctionSet(object):
         self.add('sharp_gauss', sharp_gauss_activation)
         self.add('sharp_gauss2', sharp_gauss_mu_2_activation)
 
-    def add(self, name, function):
-        validate_activation(function)
+    def add(self, name, function, vectorized_function=None):
+        '''
+        Registers an activation function. A name cannot be given to another
+        function once registered, since node genes and genome records refer
+        to functions by their registry id. Registering a function again
+        under its name only replaces its vectorized version.
+
+        name     -- name of the activation function
+        function -- scalar activation function
+        vectorized_function -- optional version of function operating elementwise
+                               on numpy arrays (looked up for built-in functions)
+        '''
+        if name in self.functions and self.functions[name] is not function:
+            raise InvalidActivationFunction(
+                "Activation function {0!r} is already registered.".format(name))
+        if vectorized_function is None:
+            vectorized_function = vectorized_versions.get(function)
+        validate_activation(function, vectorized_function)
+        if vectorized_function is None:
+            vectorized_function = vectorized(function)
         self.functions[name] = function
+        self.vectorized_functions[name] = vectorized_function
+        self.vectorized_versions[function] = vectorized_function
+        if name not in self.ids:
+            self.ids[name] = len(self.id_functions)
+            self.id_functions.append(function)
+            self.function_ids[function] = self.ids[name]
 
     def get(self, name):
         f = self.functions.get(name)
         if f is None:
             raise InvalidActivationFunction("No such activation function: {0!r}".format(name))
-        return f
\ No newline at end of file
+        return f
+
+    def get_vectorized(self, name):
+        self.get(name)
+        return self.vectorized_functions[name]
+
+    def vectorized(self, function):
+        '''
+        Returns the vectorized version of an activation function, as
+        registered on this set.
+
+        function -- scalar activation function
+        '''
+        vectorized_function = self.vectorized_versions.get(function)
+        if vectorized_function is None:
+            vectorized_function = vectorized(function)
+        return vectorized_function
+
+    def get_id(self, name):
+        self.get(name)
+        return self.ids[name]
+
+    def get_by_id(self, function_id):
+        return self.id_functions[function_id]
+
+    def id_of(self, function):
+        function_id = self.function_ids.get(function)
+        if function_id is None:
+            raise InvalidActivationFunction("Unregistered activation function: {0!r}".format(function))
+        return function_id
@@ -0,0 +1,71 @@
+'''
+Evaluates the fitness of a population with asyncio, for tasks that spend
+their time waiting on I/O (e.g. simulators behind a socket).
+'''
+import asyncio
+
+class AsyncEvaluator:
+
+	def __init__(self, eval_coroutine, max_concurrency=16, timeout=None, timeout_fitness=0.0,
+				 error_fitness=0.0, loop=None):
+		'''
+		Runs a coroutine for every genome of a population on an event loop,
+		with at most max_concurrency evaluations in flight. An instance is a
+		task for Population.run(), which also wraps plain coroutine functions
+		in an AsyncEvaluator with the default settings.
+
+		eval_coroutine  -- coroutine function taking a genome and returning its fitness
+		max_concurrency -- maximum number of genomes evaluated at the same time
+		timeout 		-- optional number of seconds after which an evaluation is
+						   cancelled and the genome given timeout_fitness
+		timeout_fitness -- fitness of genomes whose evaluation timed out
+		error_fitness 	-- fitness of genomes whose evaluation raised an exception.
+						   The other genomes of the generation are still evaluated.
+		loop 			-- optional event loop to run every generation on. Without
+						   one, each generation runs on a new loop (asyncio.run), so
+						   objects bound to a loop, such as client sessions, cannot
+						   be kept between generations.
+		'''
+		self.eval_coroutine = eval_coroutine
+		self.max_concurrency = max_concurrency
+		self.timeout = timeout
+		self.timeout_fitness = timeout_fitness
+		self.error_fitness = error_fitness
+		self.loop = loop
+		self.timeouts = 0
+		self.errors = 0
+		# Most recent exception raised by an evaluation
+		self.last_error = None
+
+	def __call__(self, genomes):
+		'''
+		Assigns the fitness of each genome. Must not be called from a running
+		event loop; use evaluate_all() there instead.
+
+		genomes -- list of (genome key, genome) tuples
+		'''
+		if self.loop is None:
+			asyncio.run(self.evaluate_all(genomes))
+		else:
+			self.loop.run_until_complete(self.evaluate_all(genomes))
+
+	async def evaluate_all(self, genomes):
+		'''
+		Assigns the fitness of each genome.
+
+		genomes -- list of (genome key, genome) tuples
+		'''
+		semaphore = asyncio.Semaphore(self.max_concurrency)
+		await asyncio.gather(*[self.evaluate(genome, semaphore) for _, genome in genomes])
+
+	async def evaluate(self, genome, semaphore):
+		async with semaphore:
+			try:
+				genome.fitness = await asyncio.wait_for(self.eval_coroutine(genome), self.timeout)
+			except asyncio.TimeoutError:
+				genome.fitness = self.timeout_fitness
+				self.timeouts += 1
+			except Exception as e:
+				genome.fitness = self.error_fitness
+				self.errors += 1
+				self.last_error = e
@@ -0,0 +1,123 @@
+'''
+Bounded cache of decoded phenomes keyed by genome content.
+
+Elites are cloned into the next generation unchanged, so their CPPNs and
+substrates can be reused instead of being decoded again every generation.
+Population.step() evicts the phenomes of genomes that have left the
+population from the cache of its task (see SupervisedTask) before each
+evaluation, so that cache only holds what can still be hit.
+'''
+import hashlib
+from collections import OrderedDict
+from deep_hyperneat.phenomes import FeedForwardCPPN
+from deep_hyperneat.decode import decode
+
+def genome_fingerprint(genome):
+	'''
+	Returns a content hash of a genome's nodes, connections and substrate layout.
+	Genomes with equal fingerprints decode into identical phenomes. Values are
+	normalized first, so e.g. an int bias of 0 and a float bias of 0.0 (as read
+	back by the codec) hash the same.
+
+	genome -- genome to fingerprint
+	'''
+	nodes = sorted((int(node.key), node.type, float(node.bias), int(node.activation_id),
+					sheet_pair(node.cppn_tuple))
+				for node in genome.nodes.values())
+	connections = sorted(((int(conn.key[0]), int(conn.key[1])), float(conn.weight), bool(conn.enabled))
+						for conn in genome.connections.values())
+	layout = (sorted((int(layer), [int(sheet) for sheet in sheets]) for layer, sheets in genome.substrate.items()),
+			[int(key) for key in genome.input_keys], [int(key) for key in genome.output_keys],
+			[None if key is None else int(key) for key in genome.bias_keys])
+	content = repr((nodes, connections, layout)).encode()
+	return hashlib.sha1(content).hexdigest()
+
+def sheet_pair(cppn_tuple):
+	# (source sheet, target sheet) of a node as plain ints, or None
+	if cppn_tuple is None:
+		return None
+	return tuple(tuple(int(x) for x in sheet) for sheet in cppn_tuple)
+
+class PhenotypeCache:
+	# LRU cache of decoded CPPNs and substrates
+	def __init__(self, max_size=1000):
+		'''
+		max_size -- maximum number of phenomes (CPPNs and substrates) kept, which
+					also bounds processes that never call retain() (e.g.
+					evaluation workers)
+		'''
+		self.max_size = max_size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def cppn(self, genome):
+		'''
+		Returns the CPPN of a genome, creating it only if not cached.
+
+		genome -- genome to be decoded
+		'''
+		key = ('cppn', genome_fingerprint(genome))
+		cppn = self.lookup(key)
+		if cppn is None:
+			cppn = FeedForwardCPPN.create(genome)
+			self.store(key, cppn)
+		return cppn
+
+	def substrate(self, genome, input_dimensions, output_dimensions, sheet_dimensions=None):
+		'''
+		Returns the substrate of a genome, decoding it only if not cached.
+
+		genome           -- genome to be decoded
+		input_dimensions -- dimensions of substrate input layer
+		output_dimension -- dimensions of substrate output layer
+		sheet_dimensions -- optional substrate sheet dimensions
+		'''
+		dimensions = (tuple(input_dimensions), output_dimensions,
+					  tuple(sheet_dimensions) if sheet_dimensions else None)
+		key = ('substrate', genome_fingerprint(genome), dimensions)
+		substrate = self.lookup(key)
+		if substrate is None:
+			substrate = decode(self.cppn(genome), input_dimensions,
+							   output_dimensions, sheet_dimensions)
+			self.store(key, substrate)
+		return substrate
+
+	def lookup(self, key):
+		phenome = self.entries.get(key)
+		if phenome is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return phenome
+
+	def store(self, key, phenome):
+		self.entries[key] = phenome
+		while len(self.entries) > self.max_size:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+
+	def retain(self, genomes):
+		'''
+		Evicts the phenomes of every genome not in genomes, i.e. genomes that
+		have left the population.
+
+		genomes -- genomes whose phenomes are kept
+		'''
+		if not self.entries:
+			return
+		fingerprints = {genome_fingerprint(genome) for genome in genomes}
+		for key in [key for key in self.entries if key[1] not in fingerprints]:
+			del self.entries[key]
+			self.evictions += 1
+
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+# Cache shared by task functions and reporters
+phenotype_cache = PhenotypeCache()
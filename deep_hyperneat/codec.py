@@ -0,0 +1,223 @@
+'''
+Versioned binary encoding of genomes, used for checkpoints and for sending
+genomes between processes.
+
+A genome record stores its node and connection genes as packed arrays, along
+with its keys, substrate layout and next node key. Activation functions and
+node types are written by name, so a record does not depend on the order in
+which activation functions were registered.
+'''
+import struct
+import numpy as np
+from deep_hyperneat.genome import Genome, NodeGene, ConnectionGene
+from deep_hyperneat.util import iteritems, itervalues
+
+# Bumped whenever the record layout changes
+GENOME_VERSION = 1
+GENOME_MAGIC = b'DHNG'
+
+# Stands in for missing keys (e.g. a None bias key) in packed key arrays
+NO_KEY = np.iinfo(np.int64).min
+
+header_format = struct.Struct('<4sHqd5iq')
+count_format = struct.Struct('<I')
+node_dtype = np.dtype([('key', '<i8'), ('type', '<u2'), ('activation', '<u2'),
+					   ('bias', '<f8'), ('response', '<f8'),
+					   ('has_tuple', 'u1'), ('cppn_tuple', '<i4', (4,))])
+connection_dtype = np.dtype([('source', '<i8'), ('target', '<i8'),
+							 ('weight', '<f8'), ('enabled', 'u1')])
+
+class GenomeCodecError(ValueError):
+	pass
+
+def unpack_count(data, offset):
+	'''
+	Unpacks a length prefix. Returns the length and the new offset.
+	'''
+	return count_format.unpack_from(data, offset)[0], offset + count_format.size
+
+def pack_names(names):
+	'''
+	Packs a list of short strings.
+	'''
+	chunks = [count_format.pack(len(names))]
+	for name in names:
+		data = name.encode('utf-8')
+		chunks.append(struct.pack('<B', len(data)))
+		chunks.append(data)
+	return b''.join(chunks)
+
+def unpack_names(data, offset):
+	'''
+	Unpacks a list of short strings. Returns the list and the new offset.
+	'''
+	num_names, offset = unpack_count(data, offset)
+	names = []
+	for _ in range(num_names):
+		length = data[offset]
+		names.append(bytes(data[offset+1:offset+1+length]).decode('utf-8'))
+		offset += 1 + length
+	return names, offset
+
+def pack_array(array):
+	'''
+	Packs a one-dimensional array, prefixed by its length.
+	'''
+	return count_format.pack(len(array)) + array.tobytes()
+
+def unpack_array(data, offset, dtype):
+	'''
+	Unpacks an array written by pack_array. Returns the array and the new offset.
+	'''
+	length, offset = unpack_count(data, offset)
+	array = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+	return array, offset + length*array.itemsize
+
+def pack_keys(keys):
+	return pack_array(np.array([NO_KEY if k is None else k for k in keys], dtype='<i8'))
+
+def unpack_keys(data, offset):
+	keys, offset = unpack_array(data, offset, '<i8')
+	return [None if k == NO_KEY else k for k in keys.tolist()], offset
+
+def encode_genome(genome):
+	'''
+	Returns the binary record of a genome.
+
+	genome -- genome to encode
+	'''
+	activation_names = {i: name for name, i in iteritems(genome.activations.ids)}
+	# Names used by this genome, indexed by the node tables
+	names = []
+	name_index = {}
+	def index(name):
+		if name not in name_index:
+			name_index[name] = len(names)
+			names.append(name)
+		return name_index[name]
+	nodes = np.array([(node.key, index(node.type), index(activation_names[node.activation_id]),
+					   node.bias, node.response, node.cppn_tuple is not None,
+					   sum(node.cppn_tuple, ()) if node.cppn_tuple is not None else (0, 0, 0, 0))
+					  for node in itervalues(genome.nodes)], dtype=node_dtype)
+	connections = np.array([(conn.key[0], conn.key[1], conn.weight, conn.enabled)
+							for conn in itervalues(genome.connections)], dtype=connection_dtype)
+	# Each substrate layer is stored as its key, its number of sheets and the sheets
+	substrate = [(layer, len(sheets)) + tuple(sheets) for layer, sheets in iteritems(genome.substrate)]
+	cppn_tuples = np.array([sum(t, ()) for t in genome.cppn_tuples], dtype='<i4').reshape(-1, 4)
+	next_node_key = -1 if genome.next_node_key is None else genome.next_node_key
+	fitness = np.nan if genome.fitness is None else float(genome.fitness)
+	return b''.join([
+		header_format.pack(GENOME_MAGIC, GENOME_VERSION, genome.key, fitness,
+						   genome.num_inputs, genome.num_outputs, genome.num_layers,
+						   genome.num_depth, genome.num_breadth, next_node_key),
+		pack_names(names),
+		pack_keys(genome.input_keys),
+		pack_keys(genome.output_keys),
+		pack_keys(genome.bias_keys),
+		pack_array(cppn_tuples.ravel()),
+		pack_array(np.array([x for entry in substrate for x in entry], dtype='<i4')),
+		pack_array(nodes),
+		pack_array(connections)])
+
+def decode_genome(data):
+	'''
+	Returns the genome stored in a binary record.
+
+	data -- bytes of a record written by encode_genome
+	'''
+	data = memoryview(data)
+	if len(data) < header_format.size:
+		raise GenomeCodecError("Truncated genome record.")
+	(magic, version, key, fitness, num_inputs, num_outputs, num_layers,
+	 num_depth, num_breadth, next_node_key) = header_format.unpack_from(data, 0)
+	if magic != GENOME_MAGIC:
+		raise GenomeCodecError("Not a genome record.")
+	if version != GENOME_VERSION:
+		raise GenomeCodecError("Unsupported genome record version: {0}".format(version))
+	offset = header_format.size
+	try:
+		names, offset = unpack_names(data, offset)
+		input_keys, offset = unpack_keys(data, offset)
+		output_keys, offset = unpack_keys(data, offset)
+		bias_keys, offset = unpack_keys(data, offset)
+		cppn_tuples, offset = unpack_array(data, offset, '<i4')
+		substrate_entries, offset = unpack_array(data, offset, '<i4')
+		nodes, offset = unpack_array(data, offset, node_dtype)
+		connections, offset = unpack_array(data, offset, connection_dtype)
+	except (struct.error, ValueError, IndexError) as e:
+		raise GenomeCodecError("Truncated genome record.") from e
+	genome = Genome.__new__(Genome)
+	genome.key = key
+	genome.fitness = None if np.isnan(fitness) else fitness
+	genome.next_node_key = None if next_node_key < 0 else next_node_key
+	genome.num_inputs = num_inputs
+	genome.num_outputs = num_outputs
+	genome.num_layers = num_layers
+	genome.num_depth = num_depth
+	genome.num_breadth = num_breadth
+	genome.input_keys = input_keys
+	genome.output_keys = output_keys
+	genome.bias_keys = bias_keys
+	genome.cppn_tuples = [((a, b), (c, d)) for a, b, c, d in cppn_tuples.reshape(-1, 4).tolist()]
+	genome.substrate = {}
+	entries = substrate_entries.tolist()
+	position = 0
+	while position < len(entries):
+		layer, num_sheets = entries[position], entries[position+1]
+		genome.substrate[layer] = entries[position+2:position+2+num_sheets]
+		position += 2 + num_sheets
+	genome.nodes = {}
+	genome.connections = {}
+	genome.incoming = {}
+	genome.outgoing = {}
+	genome.release_genes()
+	activation_ids = [genome.activations.ids.get(name) for name in names]
+	for node_key, node_type, activation, bias, response, has_tuple, t in nodes.tolist():
+		if activation_ids[activation] is None:
+			raise GenomeCodecError("Unregistered activation function: {0!r}".format(names[activation]))
+		node = NodeGene.__new__(NodeGene)
+		node.key = node_key
+		node.type = names[node_type]
+		node.activation_id = activation_ids[activation]
+		node.bias = bias
+		node.response = response
+		# Subarray fields come back as arrays; the tuple holds plain ints
+		node.cppn_tuple = tuple(map(tuple, t.reshape(2, 2).tolist())) if has_tuple else None
+		genome.nodes[node_key] = node
+		genome.owned_nodes.add(node_key)
+	for source_key, target_key, weight, enabled in connections.tolist():
+		conn = ConnectionGene.__new__(ConnectionGene)
+		conn.key = (source_key, target_key)
+		conn.weight = weight
+		conn.enabled = bool(enabled)
+		genome.connections[conn.key] = conn
+		genome.owned_connections.add(conn.key)
+		genome.index_connection(conn.key)
+	genome._complexity = len(genome.nodes) + len(genome.connections)
+	return genome
+
+def write_genome(stream, genome):
+	'''
+	Writes a length-prefixed genome record to a binary stream.
+
+	stream -- writable binary file object
+	genome -- genome to write
+	'''
+	record = encode_genome(genome)
+	stream.write(count_format.pack(len(record)))
+	stream.write(record)
+
+def read_genome(stream):
+	'''
+	Reads a genome written by write_genome from a binary stream.
+
+	stream -- readable binary file object
+	'''
+	prefix = stream.read(count_format.size)
+	if len(prefix) != count_format.size:
+		raise GenomeCodecError("Truncated genome record.")
+	(length,) = count_format.unpack(prefix)
+	record = stream.read(length)
+	if len(record) != length:
+		raise GenomeCodecError("Truncated genome record.")
+	return decode_genome(record)
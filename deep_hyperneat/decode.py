@@ -8,11 +8,19 @@ Felix Sosa
 '''
 import numpy as np
 import itertools as it
-from deep_hyperneat.activations import ActivationFunctionSet
-from deep_hyperneat.phenomes import FeedForwardSubstrate
-import time
+from functools import lru_cache
+from deep_hyperneat.genome import activations
+from deep_hyperneat.phenomes import FeedForwardSubstrate, SparseSubstrate
+from deep_hyperneat.profiling import profiler
 
-def decode(cppn, input_dimensions, output_dimensions, sheet_dimensions=None):
+# Sheet ids reserved for the output, input and bias sheets
+reserved_sheets = ((0,0), (1,0), (1,1))
+# Maximum number of CPPN queries activated in one batch. Bounds the memory of
+#   a query, which would otherwise grow with the product of both layer sizes.
+max_batch_queries = 1 << 14
+
+def decode(cppn, input_dimensions, output_dimensions, sheet_dimensions=None, layout=None,
+           expression_threshold=None, sparse=False):
     '''
     Decodes a CPPN into a substrate.
 
@@ -20,8 +28,44 @@ def decode(cppn, input_dimensions, output_dimensions, sheet_dimensions=None):
     input_dimensions -- dimensions of substrate input layer
     output_dimension -- dimensions of substrate output layer
     sheet_dimensions -- optional substrate sheet dimensions
+    layout           -- optional precomputed SubstrateLayout covering every sheet
+                        of the CPPN (dimensions are ignored if given)
+    expression_threshold -- optional minimum weight magnitude for a link to be expressed
+    sparse           -- if True, return a SparseSubstrate storing only expressed links
+    '''
+    with profiler.timer('decode'):
+        # Look up the (memoized) substrate layout for this CPPN's sheets
+        if layout is None:
+            hidden_sheets = {cppn.nodes[node].cppn_tuple[0] for node in cppn.output_nodes}
+            layout = get_layout(input_dimensions, output_dimensions, sheet_dimensions, hidden_sheets)
+
+        # Create list of mappings to be created between substrate sheets
+        connection_mappings = [cppn.nodes[x].cppn_tuple for x in cppn.output_nodes if cppn.nodes[x].cppn_tuple[0] != (1,1)]
+
+        # Create dictionary of output node IDs to their respective mapping tuples
+        cppn_idx_dict = {cppn.nodes[idx].cppn_tuple:idx for idx in cppn.output_nodes}
+
+        # Create the substrate
+        with profiler.timer('create_substrate'):
+            return create_substrate(cppn, layout.substrate, connection_mappings, cppn_idx_dict, layout=layout,
+                                    expression_threshold=expression_threshold, sparse=sparse)
+
+def get_layout(input_dimensions, output_dimensions, sheet_dimensions=None, hidden_sheets=()):
+    '''
+    Returns the SubstrateLayout for the given dimensions and sheets. Layouts
+    are memoized, so genomes sharing a substrate shape share one layout.
+
+    input_dimensions -- dimensions of substrate input layer
+    output_dimension -- dimensions of substrate output layer
+    sheet_dimensions -- optional substrate sheet dimensions
+    hidden_sheets    -- ids of the sheets in the substrate (in iteration order)
     '''
+    return _cached_layout(tuple(input_dimensions), output_dimensions,
+                          tuple(sheet_dimensions) if sheet_dimensions else None,
+                          tuple(hidden_sheets))
 
+@lru_cache(maxsize=256)
+def _cached_layout(input_dimensions, output_dimensions, sheet_dimensions, hidden_sheets):
     # Create input layer coordinate map from specified input dimensions
     x = np.linspace(-1.0, 1.0, input_dimensions[1]) if (input_dimensions[1] > 1) else [0.0]
     y = np.linspace(-1.0, 1.0, input_dimensions[0]) if (input_dimensions[0] > 1) else [0.0]
@@ -40,23 +84,43 @@ def decode(cppn, input_dimensions, output_dimensions, sheet_dimensions=None):
     else:
         sheet = input_layer
 
-    # Create list of mappings to be created between substrate sheets
-    connection_mappings = [cppn.nodes[x].cppn_tuple for x in cppn.output_nodes if cppn.nodes[x].cppn_tuple[0] != (1,1)]
-
     # Create substrate representation (dictionary of sheets and their respective coordinate maps)
-    hidden_sheets = {cppn.nodes[node].cppn_tuple[0] for node in cppn.output_nodes}
     substrate = {s:sheet for s in hidden_sheets}
     substrate[(1,0)] = input_layer
     substrate[(0,0)] = output_layer
     substrate[(1,1)] = [(0.0,0.0)]
+    return SubstrateLayout(substrate)
+
+class SubstrateLayout():
+    def __init__(self, substrate):
+        '''
+        Coordinate arrays, node ids and layer ordering of a substrate, computed
+        once and shared by every genome decoded into the same substrate shape.
+
+        substrate -- substrate representation (a dictionary of sheets and their respective coordinate maps)
+        '''
+        self.substrate = {}
+        for sheet_id, coordinates in substrate.items():
+            coordinates = np.array(coordinates, dtype=float).reshape(-1, 2)
+            coordinates.setflags(write=False)
+            self.substrate[sheet_id] = coordinates
+        self.layers = gather_layers(self.substrate)
 
-    # Create dictionary of output node IDs to their respective mapping tuples
-    cppn_idx_dict = {cppn.nodes[idx].cppn_tuple:idx for idx in cppn.output_nodes}
+        # Assign ids to nodes in the substrate
+        num_inputs, num_bias = len(self.substrate[(1,0)]), len(self.substrate[(1,1)])
+        num_outputs = len(self.substrate[(0,0)])
+        self.input_node_ids = list(range(num_inputs))
+        self.bias_node_ids = list(range(num_inputs, num_inputs+num_bias))
+        self.output_node_ids = list(range(num_inputs+num_bias, num_inputs+num_bias+num_outputs))
 
-    # Create the substrate
-    return create_substrate(cppn, substrate, connection_mappings, cppn_idx_dict)
+        # Assign ids to nodes in all hidden layers
+        self.hidden_sheets = [k for k in self.substrate if k not in reserved_sheets]
+        number_of_hidden_nodes = sum([len(self.substrate[k]) for k in self.hidden_sheets])
+        start_index = num_inputs+num_bias+num_outputs
+        self.hidden_node_ids = list(range(start_index, start_index+number_of_hidden_nodes))
 
-def create_substrate(cppn, substrate, mapping_tuples, id_dict, act_func="relu"):
+def create_substrate(cppn, substrate, mapping_tuples, id_dict, act_func="relu", layout=None,
+                     expression_threshold=None, sparse=False):
     '''
     Creates a neural network from a CPPN and substrate representation.
 
@@ -67,110 +131,132 @@ def create_substrate(cppn, substrate, mapping_tuples, id_dict, act_func="relu"):
     mapping_tuples -- list of mappings to be created between substrate sheets
     id_dict   -- dictionary of output node IDs and their respective mapping tuples
     act_func  -- optional argument for the activation function of the substrate
+    layout    -- optional precomputed SubstrateLayout of substrate
+    expression_threshold -- optional minimum weight magnitude for a link to be expressed
+    sparse    -- if True, return a SparseSubstrate storing only expressed links
     '''
-    node_evals, layers = [], gather_layers(substrate)
+    if layout is None:
+        layout = SubstrateLayout(substrate)
+    substrate, layers = layout.substrate, layout.layers
+    node_evals = []
+    # Boundaries between substrate layers within node_evals
+    layer_bounds = [0]
 
     # Assign coordinates to input, output, and bias layers
     input_coordinates, output_coordinates, bias_coordinates = (substrate[(1,0)],(1,0)), (substrate[(0,0)],(0,0)), (substrate[(1,1)],(1,1))
 
-    # Assign ids to nodes in the substrate
-    input_node_ids = list(range(len(input_coordinates[0])))
-    bias_node_ids = list(range(len(input_node_ids), len(input_node_ids+bias_coordinates[0])))
-    output_node_ids = list(range(len(input_node_ids+bias_node_ids), len(input_node_ids+bias_node_ids+output_coordinates[0])))
-
-    # Remove the input and output layers from the substrate dictionary
-    del substrate[(1,0)], substrate[(0,0)], substrate[(1,1)]
-
-    # Create hidden layer coordinate maps
-    hidden_coordinates = [(substrate[k], k) for k in substrate.keys()]
+    # Node ids in the substrate
+    input_node_ids, bias_node_ids = layout.input_node_ids, layout.bias_node_ids
+    output_node_ids, hidden_node_ids = layout.output_node_ids, layout.hidden_node_ids
 
-    # Assign ids to nodes in all hidden layers
-    number_of_hidden_nodes = sum([len(layer[0]) for layer in hidden_coordinates])
-    start_index = len(input_node_ids+output_node_ids+bias_node_ids)
-    hidden_node_ids = list(range(start_index, start_index+number_of_hidden_nodes))
-
-    # Get activation function for substrate
-    act_func_set = ActivationFunctionSet()
-    hidden_activation = act_func_set.get(act_func)
-    output_activation = act_func_set.get('linear')
+    # Get activation function for substrate from the registry shared with genomes
+    hidden_activation = activations.get(act_func)
+    output_activation = activations.get('linear')
 
     # Decode depending on whether there are hidden layers or not
     if hidden_node_ids:
 
         # Query CPPN for mapping between output layer and topmost hidden layer
         out_hid_mapping_tuples = [mapping for mapping in mapping_tuples if mapping[1] == (0,0)]
-        out_node_counter, idx, hidden_idx = 0, 0, 0
+        bias_links = query_cppn_links(cppn, output_coordinates, bias_coordinates, id_dict,
+                                      bias_node_ids[0], expression_threshold)
+        hidden_links = []
+        # Index into hidden_node_ids of the first node of each source sheet
+        offset = 0
+        for mapping in out_hid_mapping_tuples:
+            hidden_links.append(query_cppn_links(cppn, output_coordinates, (substrate[mapping[0]], mapping[0]), id_dict,
+                                                 hidden_node_ids[offset], expression_threshold))
+            offset += len(substrate[mapping[0]])
+        out_node_counter = 0
         # For each coordinate in output sheet
-        for oc in output_coordinates[0]:
+        for row in range(len(output_coordinates[0])):
             # Adding Biases from Output to Hidden
-            node_connections = query_cppn(cppn,oc,output_coordinates,bias_coordinates,bias_node_ids[0], id_dict)
+            node_connections = [bias_links[row]]
             # For each connection mapping
-            for mapping in out_hid_mapping_tuples:
-                source_sheet_id = mapping[0]
-                node_connections += query_cppn(cppn,oc,output_coordinates,(substrate[source_sheet_id],source_sheet_id), hidden_node_ids[idx], id_dict)
-                idx += len(substrate[source_sheet_id])
-            if node_connections:
-                node_evals.append((output_node_ids[out_node_counter], output_activation, sum, node_connections))
-            hidden_idx = idx
-            idx = 0
+            for links in hidden_links:
+                node_connections.append(links[row])
+            node_evals.append((output_node_ids[out_node_counter], output_activation, sum, join_links(node_connections, sparse)))
             out_node_counter += 1
+        layer_bounds.append(len(node_evals))
 
         # Query CPPN for mapping between hidden layers (from top to bottom)
         hid_node_counter = 0
-        next_idx = idx = hidden_idx
         # For each hidden layer in the substrate, going from top to bottom
         for layer_idx in range((len(layers)-1), 2, -1):
+            # Every sheet of a layer numbers its source sheets from the same index
+            layer_offset = offset
             # For each sheet in the current layer, i
             for sheet_idx in range(len(layers[layer_idx])):
                 # Assign target sheet id
                 target_sheet_id = layers[layer_idx][sheet_idx]
+                target_layer = (substrate[target_sheet_id], target_sheet_id)
                 hid_hid_mapping_tuple = [mapping for mapping in mapping_tuples if (mapping[1] == target_sheet_id)]
+                bias_links = query_cppn_links(cppn, target_layer, bias_coordinates, id_dict,
+                                              bias_node_ids[0], expression_threshold)
+                hidden_links = []
+                offset = layer_offset
+                for mapping in hid_hid_mapping_tuple:
+                    hidden_links.append(query_cppn_links(cppn, target_layer, (substrate[mapping[0]], mapping[0]), id_dict,
+                                                         hidden_node_ids[offset], expression_threshold))
+                    offset += len(substrate[mapping[0]])
                 # For each coordinate in target sheet
-                for hc in substrate[target_sheet_id]:
+                for row in range(len(substrate[target_sheet_id])):
                     # Adding Biases from Hidden to Hidden
-                    node_connections = query_cppn(cppn,hc,(substrate[target_sheet_id],target_sheet_id),bias_coordinates,bias_node_ids[0], id_dict)
-                    for mapping in hid_hid_mapping_tuple:
-                        source_sheet_id = mapping[0]
-                        node_connections += query_cppn(cppn,hc,(substrate[target_sheet_id],target_sheet_id),(substrate[source_sheet_id], source_sheet_id),hidden_node_ids[idx], id_dict)
-                        idx += len(substrate[source_sheet_id])
-                    if node_connections:
-                        node_evals.append((hidden_node_ids[hid_node_counter],hidden_activation,sum, node_connections))
+                    node_connections = [bias_links[row]]
+                    for links in hidden_links:
+                        node_connections.append(links[row])
+                    node_evals.append((hidden_node_ids[hid_node_counter],hidden_activation,sum, join_links(node_connections, sparse)))
                     hid_node_counter += 1
-                    next_idx = idx
-                    idx = hidden_idx
-            idx = next_idx
-            hidden_idx = next_idx
+            layer_bounds.append(len(node_evals))
 
         # Query CPPN for mapping between bottom hidden layer to input layer
-        idx = 0
         for i in range(len(layers[2])):
             # Assign target
             target_sheet_id = layers[2][i]
+            target_layer = (substrate[target_sheet_id], target_sheet_id)
+            input_links = query_cppn_links(cppn, target_layer, input_coordinates, id_dict,
+                                           input_node_ids[0], expression_threshold)
+            bias_links = query_cppn_links(cppn, target_layer, bias_coordinates, id_dict,
+                                          bias_node_ids[0], expression_threshold)
             # For each coordinate in target sheet
-            for hc in substrate[target_sheet_id]:
-                node_connections = query_cppn(cppn, hc, (substrate[target_sheet_id],target_sheet_id), input_coordinates, input_node_ids[idx], id_dict)
+            for row in range(len(substrate[target_sheet_id])):
+                node_connections = [input_links[row]]
                 # Adding Biases from Hidden to Input
-                node_connections += query_cppn(cppn,hc,(substrate[target_sheet_id],target_sheet_id),bias_coordinates,bias_node_ids[0], id_dict)
-                if node_connections:
-                    node_evals.append((hidden_node_ids[hid_node_counter],hidden_activation, sum,node_connections))
+                node_connections.append(bias_links[row])
+                node_evals.append((hidden_node_ids[hid_node_counter],hidden_activation, sum,join_links(node_connections, sparse)))
                 hid_node_counter += 1
+        layer_bounds.append(len(node_evals))
 
     # No hidden layers
     else:
         # Output Input Layer
-        idx, counter = 0, 0
+        counter = 0
+        input_links = query_cppn_links(cppn, output_coordinates, input_coordinates, id_dict,
+                                       input_node_ids[0], expression_threshold)
+        bias_links = query_cppn_links(cppn, output_coordinates, bias_coordinates, id_dict,
+                                      bias_node_ids[0], expression_threshold)
         for i in range(len(layers[0])):
             # Assign target
             target_sheet_id = layers[0][i]
             # For each coordinate in target sheet
-            for oc in output_coordinates[0]:
-                node_connections = query_cppn(cppn,oc,output_coordinates,input_coordinates,input_node_ids[idx], id_dict)
-                node_connections += query_cppn(cppn,oc,output_coordinates,bias_coordinates,bias_node_ids[idx], id_dict)
-                if node_connections:
-                    node_evals.append((output_node_ids[counter],output_activation,sum,node_connections))
+            for row in range(len(output_coordinates[0])):
+                node_connections = [input_links[row]]
+                node_connections.append(bias_links[row])
+                node_evals.append((output_node_ids[counter],output_activation,sum,join_links(node_connections, sparse)))
                 counter += 1
+        layer_bounds.append(len(node_evals))
 
-    return FeedForwardSubstrate(input_node_ids, bias_node_ids, output_node_ids, node_evals)
+    # Node ids of each substrate layer, ordered from the bottom layer to the output layer
+    substrate_layers = [[node_eval[0] for node_eval in node_evals[start:end]]
+                        for start, end in zip(layer_bounds, layer_bounds[1:]) if end > start][::-1]
+    if profiler.enabled:
+        profiler.count('substrate_links', sum(len(node_eval[3][0]) if sparse else len(node_eval[3])
+                                              for node_eval in node_evals))
+    if sparse:
+        return SparseSubstrate(input_node_ids, bias_node_ids, output_node_ids, node_evals, substrate_layers,
+                               activations)
+    return FeedForwardSubstrate(input_node_ids, bias_node_ids, output_node_ids, node_evals, substrate_layers,
+                                activations)
 
 def query_cppn(cppn, source_coordinate, source_layer, target_layer, node_idx, id_dict, max_weight=5.0):
     '''
@@ -192,6 +278,7 @@ def query_cppn(cppn, source_coordinate, source_layer, target_layer, node_idx, id
     source_layer_id = source_layer[1]
     mapping_tuple = (target_layer_id,source_layer_id)
     cppnon_id = id_dict[mapping_tuple]
+    profiler.count('cppn_queries', len(target_coordinates))
     for target_coordinate in target_coordinates:
         i = [target_coordinate[0], target_coordinate[1], source_coordinate[0], source_coordinate[1]]
         w = cppn.activate(i)[cppnon_id]
@@ -204,6 +291,96 @@ def query_cppn(cppn, source_coordinate, source_layer, target_layer, node_idx, id
         node_idx += 1
     return node_connections
 
+def query_cppn_batch(cppn, source_layer, target_layer, id_dict, max_weight=5.0):
+    '''
+    Query the CPPN for potential weights for all possible connections between
+    every node of one layer and every node of another in a single batched pass.
+
+    Equivalent to calling query_cppn() for each coordinate of source_layer.
+    Memory grows with the product of both layer sizes; query_cppn_links()
+    splits large layers into bounded batches.
+
+    cppn         -- CPPN
+    source_layer -- layer of nodes to be connected to target_layer
+    target_layer -- layer of nodes to which each node in source_layer will be connected
+    id_dict      -- dictionary of CPPN output node ids and their respective mapping tuples
+
+    Returns a matrix of clamped weights with one row per source_layer coordinate
+    and one column per target_layer coordinate.
+    '''
+    source_coordinates = np.asarray(source_layer[0], dtype=float).reshape(-1, 2)
+    target_coordinates = np.asarray(target_layer[0], dtype=float).reshape(-1, 2)
+    cppnon_id = id_dict[(target_layer[1], source_layer[1])]
+    num_sources, num_targets = len(source_coordinates), len(target_coordinates)
+    profiler.count('cppn_queries', num_sources*num_targets)
+    # One CPPN query per (source, target) pair, ordered source-major
+    queries = np.empty((num_sources*num_targets, 4))
+    queries[:, :2] = np.tile(target_coordinates, (num_sources, 1))
+    queries[:, 2:] = np.repeat(source_coordinates, num_targets, axis=0)
+    w = cppn.activate_batch(queries)[cppnon_id].reshape(num_sources, num_targets)
+    abs_w = np.abs(w)
+    return np.where(abs_w < max_weight, w*max_weight,
+                    np.where(abs_w > max_weight, max_weight, 0.0))
+
+def query_cppn_links(cppn, source_layer, target_layer, id_dict, node_idx, expression_threshold=None,
+                     max_weight=5.0):
+    '''
+    Query the CPPN for the links between every node of one layer and every node
+    of another, keeping only the expressed links of each source node.
+
+    Source coordinates are queried in chunks of at most max_batch_queries
+    queries and the expression threshold is applied to each chunk, so links
+    below the threshold are never held for a whole layer pair.
+
+    cppn         -- CPPN
+    source_layer -- layer of nodes to be connected to target_layer
+    target_layer -- layer of nodes to which each node in source_layer will be connected
+    id_dict      -- dictionary of CPPN output node ids and their respective mapping tuples
+    node_idx     -- node index to begin on when traversing target_layer
+    expression_threshold -- optional minimum weight magnitude for a link to be expressed
+
+    Returns a list with the (node ids, weights) links of each source_layer coordinate.
+    '''
+    source_coordinates, source_layer_id = source_layer
+    num_targets = len(target_layer[0])
+    rows_per_chunk = max(1, max_batch_queries // max(num_targets, 1))
+    links = []
+    for start in range(0, len(source_coordinates), rows_per_chunk):
+        sources = (source_coordinates[start:start+rows_per_chunk], source_layer_id)
+        with profiler.timer('query_cppn'):
+            weights = query_cppn_batch(cppn, sources, target_layer, id_dict, max_weight)
+        links.extend(expressed_links(row, node_idx, expression_threshold) for row in weights)
+    return links
+
+def expressed_links(weights, node_idx, expression_threshold=None):
+    '''
+    Takes a row of a weight matrix from query_cppn_batch() and returns the node
+    ids and weights of the links that are expressed, numbering nodes from node_idx.
+
+    weights  -- row of clamped weights
+    node_idx -- node index to begin on when traversing the row
+    expression_threshold -- optional minimum weight magnitude for a link to be expressed
+    '''
+    node_ids = np.arange(node_idx, node_idx+len(weights))
+    if expression_threshold is not None:
+        expressed = np.abs(weights) >= expression_threshold
+        node_ids, weights = node_ids[expressed], weights[expressed]
+    return node_ids, weights
+
+def join_links(link_groups, sparse=False):
+    '''
+    Joins groups of links from expressed_links() into the links of a single node.
+
+    link_groups -- list of (node ids, weights) pairs
+    sparse      -- if True, return a (node ids, weights) pair of arrays instead
+                   of a list of (node id, weight) tuples
+    '''
+    node_ids = np.concatenate([ids for ids, _ in link_groups])
+    weights = np.concatenate([w for _, w in link_groups])
+    if sparse:
+        return node_ids, weights
+    return list(zip(node_ids.tolist(), weights.tolist()))
+
 def gather_layers(substrate):
     '''
     Takes a dictionary representation of a substrate and returns
@@ -5,12 +5,13 @@ Largely copied from neat-python. (Copyright 2015-2017, CodeReclaimers, LLC.),
 though heavily modified for DeepHyperNEAT.
 '''
 import numpy as np
-from itertools import count
+from itertools import islice
 from deep_hyperneat.util import iteritems,itervalues,iterkeys
 from random import choice, randint
 from deep_hyperneat.activations import ActivationFunctionSet
 from copy import deepcopy
 from deep_hyperneat.phenomes import creates_cycle
+from deep_hyperneat.profiling import profiler
 
 # Mutation probabilities
 node_add_prob = 0.2
@@ -22,7 +23,30 @@ weight_mutation_power = 0.1
 inc_depth_prob = 0.1
 inc_breadth_prob = 0.1
 
+# Activation functions shared by all genomes. Node genes store registry ids.
+activations = ActivationFunctionSet()
+
+def batch_mutate_weights(genomes):
+	'''
+	Perturbs the connection weights of many genomes at once. Each connection
+	is perturbed with probability weight_mutation_rate by a uniform delta in
+	[-weight_mutation_power, weight_mutation_power), drawn in a single batch.
+
+	genomes -- list of genomes whose weights are mutated
+	'''
+	connections = [(genome, key) for genome in genomes for key in genome.connections]
+	if not connections:
+		return
+	perturbed = np.flatnonzero(np.random.uniform(size=len(connections)) < weight_mutation_rate)
+	deltas = np.random.uniform(-weight_mutation_power, weight_mutation_power, len(perturbed))
+	for i, delta in zip(perturbed.tolist(), deltas.tolist()):
+		genome, key = connections[i]
+		# Connections may be shared with a parent until written
+		genome.writable_connection(key).weight += delta
+
 class Genome():
+	# Registry of activation functions available to node genes
+	activations = activations
 
 	def __init__(self, key):
 		'''
@@ -31,10 +55,18 @@ class Genome():
 		key -- genome key
 		'''
 		self.key = key
-		self.node_indexer = None
+		# Key given to the next new node (None until the first one is created)
+		self.next_node_key = None
 		# Nodes and connections
 		self.connections = {}
 		self.nodes = {}
+		# Adjacency of connections, kept in step with self.connections. Maps a
+		#	node key to an insertion-ordered dict of its source/target keys.
+		self.incoming = {}
+		self.outgoing = {}
+		# Keys of the genes and adjacency entries this genome may write to
+		#	in place. Anything else may be shared with a clone.
+		self.release_genes()
 		self.fitness = None
 		# I/O and substrate values
 		self.num_inputs = 4
@@ -49,7 +81,6 @@ class Genome():
 		#	and k is the sheet number. Note again that 1 and 0 are reserved
 		#	for input and output layers, respectively.
 		self.cppn_tuples = [((1,0), (0,0)),((1,1),(0,0))]
-		self.activations = ActivationFunctionSet()
 		self.configure()
 		self._complexity = len(self.nodes) + len(self.connections)
 		self.substrate = {1:[0,1],0:[0]}
@@ -81,7 +112,7 @@ class Genome():
 		genome -- genome to be copied
 		gen    -- the current generation the copy is taking place
 		'''
-		self.node_indexer = deepcopy(genome.node_indexer)
+		self.next_node_key = genome.next_node_key
 		self.num_inputs = deepcopy(genome.num_inputs)
 		self.num_outputs = deepcopy(genome.num_outputs)
 		self.input_keys = [x for x in genome.input_keys]
@@ -92,6 +123,7 @@ class Genome():
 		self.bias_keys = [x for x in genome.bias_keys]
 		self.nodes = {}
 		self.connections = {}
+		self.release_genes()
 		self.num_depth = deepcopy(genome.num_depth)
 		self.num_breadth = deepcopy(genome.num_breadth)
 		# Nodes
@@ -100,10 +132,99 @@ class Genome():
 								   node_copy.activation, node_copy.cppn_tuple)
 			node_to_add.bias = node_copy.bias
 			self.nodes[node_to_add.key] = node_to_add
+			self.owned_nodes.add(node_to_add.key)
 		# Connections
+		self.incoming = {}
+		self.outgoing = {}
 		for conn_copy in genome.connections.values():
 			conn_to_add = ConnectionGene(conn_copy.key, conn_copy.weight)
 			self.connections[conn_to_add.key] = conn_to_add
+			self.owned_connections.add(conn_to_add.key)
+			self.index_connection(conn_to_add.key)
+
+	def clone(self, key, gen=None):
+		'''
+		Returns a copy of this genome that shares its genes. A shared gene is
+		copied by whichever genome writes to it first, so the cost of a clone
+		grows with what is later changed rather than with the genome size.
+
+		key -- key of the new genome
+		gen -- the current generation the clone is taking place
+		'''
+		profiler.count('genomes_cloned')
+		child = self.__class__.__new__(self.__class__)
+		child.key = key
+		child.fitness = None
+		child.next_node_key = self.next_node_key
+		child.num_inputs = self.num_inputs
+		child.num_outputs = self.num_outputs
+		child.num_layers = self.num_layers
+		child.num_depth = self.num_depth
+		child.num_breadth = self.num_breadth
+		child.input_keys = list(self.input_keys)
+		child.output_keys = list(self.output_keys)
+		child.bias_keys = list(self.bias_keys)
+		child.cppn_tuples = list(self.cppn_tuples)
+		child.substrate = {layer: list(sheets) for layer, sheets in iteritems(self.substrate)}
+		child.nodes = self.nodes.copy()
+		child.connections = self.connections.copy()
+		child.incoming = self.incoming.copy()
+		child.outgoing = self.outgoing.copy()
+		child._complexity = self._complexity
+		# Both genomes now share every gene
+		self.release_genes()
+		child.release_genes()
+		return child
+
+	def release_genes(self):
+		'''
+		Gives up in-place ownership of all genes and adjacency entries, so
+		they are copied before this genome next writes to them.
+		'''
+		self.owned_nodes = set()
+		self.owned_connections = set()
+		self.owned_incoming = set()
+		self.owned_outgoing = set()
+
+	def writable_node(self, key):
+		'''
+		Returns a node gene this genome may modify, copying it first if it
+		may be shared with another genome.
+
+		key -- node key
+		'''
+		if key not in self.owned_nodes:
+			self.nodes[key] = self.nodes[key].copy()
+			self.owned_nodes.add(key)
+		return self.nodes[key]
+
+	def writable_connection(self, key):
+		'''
+		Returns a connection gene this genome may modify, copying it first if
+		it may be shared with another genome.
+
+		key -- (source key, target key) of the connection
+		'''
+		if key not in self.owned_connections:
+			self.connections[key] = self.connections[key].copy()
+			self.owned_connections.add(key)
+		return self.connections[key]
+
+	def writable_neighbours(self, adjacency, owned, key):
+		'''
+		Returns the neighbours of a node in one of the adjacency maps, copying
+		them first if they may be shared with another genome.
+
+		adjacency -- self.incoming or self.outgoing
+		owned 	  -- matching set of owned node keys
+		key 	  -- node key
+		'''
+		neighbours = adjacency.get(key)
+		if key not in owned:
+			neighbours = {} if neighbours is None else dict(neighbours)
+			adjacency[key] = neighbours
+			owned.add(key)
+		return neighbours
 
 	def create_connection(self, source_key, target_key, weight=None):
 		'''
@@ -119,8 +240,40 @@ class Genome():
 			weight = weight
 		new_conn = ConnectionGene((source_key,target_key), weight)
 		self.connections[new_conn.key] = new_conn
+		self.owned_connections.add(new_conn.key)
+		self.index_connection(new_conn.key)
 		return new_conn
 
+	def index_connection(self, key):
+		'''
+		Adds a connection to the adjacency maps.
+
+		key -- (source key, target key) of the connection
+		'''
+		source_key, target_key = key
+		self.writable_neighbours(self.outgoing, self.owned_outgoing, source_key)[target_key] = None
+		self.writable_neighbours(self.incoming, self.owned_incoming, target_key)[source_key] = None
+
+	def delete_connection(self, key):
+		'''
+		Deletes a connection gene from the genome and the adjacency maps.
+
+		key -- (source key, target key) of the connection
+		'''
+		del self.connections[key]
+		self.owned_connections.discard(key)
+		source_key, target_key = key
+		targets = self.writable_neighbours(self.outgoing, self.owned_outgoing, source_key)
+		del targets[target_key]
+		if not targets:
+			del self.outgoing[source_key]
+			self.owned_outgoing.discard(source_key)
+		sources = self.writable_neighbours(self.incoming, self.owned_incoming, target_key)
+		del sources[source_key]
+		if not sources:
+			del self.incoming[target_key]
+			self.owned_incoming.discard(target_key)
+
 	def create_node(self,node_type='hidden',mapping_tuple=None,key=None):
 		'''
 		Create a new node gene in the genome.
@@ -136,15 +289,19 @@ class Genome():
 		new_node_key = self.get_new_node_key() if key == None else key
 		new_node = NodeGene(new_node_key, node_type, activation, mapping_tuple)
 		self.nodes[new_node.key] = new_node
+		self.owned_nodes.add(new_node.key)
 		return new_node
 
-	def mutate(self, gen=None,single_struct=True):
+	def mutate(self, gen=None,single_struct=True,mutate_weights=True):
 		'''
 		Randomly choose a mutation to execute on the genome.
 
-		gen 		  -- optional argument for generation mutation occurs
-		single_struct -- optional flag for only allowing one topological
-						 mutation to occur per generation
+		gen 		   -- optional argument for generation mutation occurs
+		single_struct  -- optional flag for only allowing one topological
+						  mutation to occur per generation
+		mutate_weights -- optional flag for perturbing connection weights.
+						  Reproduction turns it off and perturbs the weights
+						  of all offspring in one batch instead.
 		'''
 		if single_struct:
 			d = max(1, (node_add_prob + node_delete_prob +
@@ -184,8 +341,8 @@ class Genome():
 				self.mutate_increment_breadth(gen)
 
 		# Mutate connection genes.
-		for conn_gene in self.connections.values():
-			conn_gene.mutate(self,gen)
+		if mutate_weights:
+			batch_mutate_weights([self])
 
 	def mutate_add_node(self,gen=None):
 		'''
@@ -195,7 +352,7 @@ class Genome():
 		'''
 		if self.connections:
 			idx = np.random.choice(range(len(self.connections)))
-			conn_to_split = list(self.connections.keys())[idx]
+			conn_to_split = next(islice(self.connections, idx, None))
 		else:
 			return
 		# Create new hidden node and add to genome
@@ -203,7 +360,7 @@ class Genome():
 		# Get weight from old connection
 		old_weight = self.connections[conn_to_split].weight
 		# Delete connection from genome
-		del self.connections[conn_to_split]
+		self.delete_connection(conn_to_split)
 		# Create i/o connections for new node
 		i, o = conn_to_split
 		self.create_connection(i, new_node.key, 1.0)
@@ -225,11 +382,11 @@ class Genome():
 		source_key = choice(possible_sources)
 		# Determine if new connection creates cycles. Currently, only
 		# 	supports feed forward networks
-		if creates_cycle(self.connections, (source_key,target_key)):
+		if creates_cycle(self.connections, (source_key,target_key), self.outgoing):
 			return
 		# Ensure connection isn't duplicate
 		if (source_key,target_key) in self.connections:
-			self.connections[(source_key,target_key)].enabled = True
+			self.writable_connection((source_key,target_key)).enabled = True
 			return
 		# Don't allow connections between two output nodes
 		if source_key in self.output_keys and target_key in self.output_keys:
@@ -247,15 +404,17 @@ class Genome():
 			return
 		# Choose random node to delete
 		del_key = np.random.choice(available_nodes)
-		# Iterate through all connections and find connections to node
+		# Find connections to and from node
 		conn_to_delete = set()
-		for k, v in iteritems(self.connections):
-			if del_key in v.key:
-				conn_to_delete.add(v.key)
+		for target_key in self.outgoing.get(del_key, ()):
+			conn_to_delete.add((del_key, target_key))
+		for source_key in self.incoming.get(del_key, ()):
+			conn_to_delete.add((source_key, del_key))
 		for i in conn_to_delete:
-			del self.connections[i]
+			self.delete_connection(i)
 		# Delete node key
 		del self.nodes[del_key]
+		self.owned_nodes.discard(del_key)
 		return del_key
 
 	def mutate_delete_connection(self,gen=None):
@@ -266,8 +425,8 @@ class Genome():
 		'''
 		if self.connections:
 			idx = np.random.choice(range(len(self.connections)))
-			key = list(self.connections.keys())[idx]
-			del self.connections[key]
+			key = next(islice(self.connections, idx, None))
+			self.delete_connection(key)
 
 	def mutate_increment_depth(self,gen=None):
 		'''
@@ -294,11 +453,10 @@ class Genome():
 				# Save key
 				b_key = new_bias_output_node.key
 				# Add connections
-				for conn in list(self.connections):
-					if conn[1] == bias_key:
-						n=self.create_connection(conn[0],
-												 new_bias_output_node.key,
-												 0)
+				for source_key in list(self.incoming.get(bias_key, ())):
+					n=self.create_connection(source_key,
+											 new_bias_output_node.key,
+											 0)
 				self.output_keys.append(new_bias_output_node.key)
 		self.bias_keys.append(b_key)
 
@@ -306,7 +464,7 @@ class Genome():
 		for key in self.output_keys:
 			tup = self.nodes[key].cppn_tuple
 			if tup[1] == (0,0) and key != b_key:
-				self.nodes[key].cppn_tuple = (tup[0],
+				self.writable_node(key).cppn_tuple = (tup[0],
 											  (source_layer,
 											   source_sheet))
 		# Create two new gaussian nodes
@@ -387,12 +545,12 @@ class Genome():
 					self.bias_keys.append(b_key)
 					self.output_keys.append(b_key)
 					# Add connections
-					for conn in list(self.connections):
-						if conn[1] == bias_key:
-							self.create_connection(conn[0],
-												   new_bias_output_node.key,
-												   self.connections[conn].weight/2.0)
-							self.connections[conn].weight /= 2.0
+					for source_key in list(self.incoming.get(bias_key, ())):
+						conn = (source_key, bias_key)
+						self.create_connection(source_key,
+											   new_bias_output_node.key,
+											   self.connections[conn].weight/2.0)
+						self.writable_connection(conn).weight /= 2.0
 
 			# Search for CPPNONs that contain the copied sheet
 			for key in self.output_keys:
@@ -407,11 +565,11 @@ class Genome():
 					output_node.bias = self.nodes[key].bias
 					keys_to_append.append(output_node.key)
 					# Create connections in CPPN and halve existing connections
-					for conn in list(self.connections):
-						if conn[1] == key:
-							self.connections[conn].weight /= 2.0
-							self.create_connection(conn[0], output_node.key,
-												self.connections[conn].weight)
+					for source_key in list(self.incoming.get(key, ())):
+						conn = (source_key, key)
+						self.writable_connection(conn).weight /= 2.0
+						self.create_connection(source_key, output_node.key,
+											self.connections[conn].weight)
 
 				# Create CPPNONs to represent the incoming connections
 				if (self.nodes[key].cppn_tuple[1] == copied_sheet and key
@@ -424,10 +582,9 @@ class Genome():
 					output_node.bias = self.nodes[key].bias
 					keys_to_append.append(output_node.key)
 					# Create connections in CPPN
-					for conn in list(self.connections):
-						if conn[1] == key:
-							self.create_connection(conn[0], output_node.key,
-													self.connections[conn].weight)
+					for source_key in list(self.incoming.get(key, ())):
+						self.create_connection(source_key, output_node.key,
+												self.connections[(source_key, key)].weight)
 			# Add new CPPNONs to genome
 			self.num_outputs += len(keys_to_append)
 			self.output_keys.extend(keys_to_append)
@@ -464,13 +621,16 @@ class Genome():
 		'''
 		Returns new node key
 		'''
-		if self.node_indexer is None:
-			self.node_indexer = count(max(self.output_keys)+1)
-		new_id = next(self.node_indexer)
+		if self.next_node_key is None:
+			self.next_node_key = max(self.output_keys)+1
+		new_id = self.next_node_key
+		self.next_node_key += 1
 		assert new_id not in self.nodes
 		return new_id
 
 class NodeGene():
+	# Slots avoid a per-gene __dict__
+	__slots__ = ('type', 'key', 'bias', 'activation_id', 'response', 'cppn_tuple')
 
 	def __init__(self,key,node_type,activation,mapping_tuple):
 		'''
@@ -488,11 +648,35 @@ class NodeGene():
 		self.response = 1.0
 		self.cppn_tuple = mapping_tuple
 
+	@property
+	def activation(self):
+		# Activation function, stored as its registry id
+		return activations.get_by_id(self.activation_id)
+
+	@activation.setter
+	def activation(self, function):
+		self.activation_id = activations.id_of(function)
+
+	def copy(self):
+		'''
+		Returns a copy of the node gene.
+		'''
+		node = NodeGene.__new__(NodeGene)
+		node.type = self.type
+		node.key = self.key
+		node.bias = self.bias
+		node.activation_id = self.activation_id
+		node.response = self.response
+		node.cppn_tuple = self.cppn_tuple
+		return node
+
 	def mutate(self,g,gen=None):
 		# Mutate attributes of node gene
 		pass
 
 class ConnectionGene():
+	# Slots avoid a per-gene __dict__
+	__slots__ = ('key', 'weight', 'enabled')
 
 	def __init__(self,key,weight):
 		'''
@@ -505,8 +689,19 @@ class ConnectionGene():
 		self.weight = weight
 		self.enabled = True
 
+	def copy(self):
+		'''
+		Returns a copy of the connection gene.
+		'''
+		conn = ConnectionGene.__new__(ConnectionGene)
+		conn.key = self.key
+		conn.weight = self.weight
+		conn.enabled = self.enabled
+		return conn
+
 	def mutate(self,g,gen=None):
-		# Mutate attributes of connection gene
+		# Mutate attributes of connection gene. The gene may be shared with
+		#	other genomes, so the change is made to g's own copy.
 		if np.random.uniform() < weight_mutation_rate:
 			delta = np.random.uniform(-1*weight_mutation_power,weight_mutation_power)
-			self.weight += delta
+			g.writable_connection(self.key).weight += delta
@@ -0,0 +1,114 @@
+'''
+Bounded per-generation history of an evolutionary run.
+
+Only summary statistics are recorded, never genomes. The most recent entries
+are kept in memory and older ones are appended to a JSON lines file as they
+leave the buffer, so memory use stays flat however long a run is.
+'''
+import os
+import json
+import weakref
+import tempfile
+from collections import deque
+
+class RunHistory:
+
+	def __init__(self, max_entries=1000, spill_path=None, append=False):
+		'''
+		max_entries -- number of most recent generations kept in memory
+		spill_path  -- optional file older generations are written to. Closing
+					   the history also writes the generations still in memory,
+					   so the file then holds the whole run. Without it, older
+					   generations go to a temporary file that is deleted with
+					   the history.
+		append 		-- if True, keep the generations already in spill_path (e.g.
+					   when resuming from a checkpoint) instead of replacing them
+		'''
+		self.max_entries = max_entries
+		self.spill_path = spill_path
+		self.temporary = spill_path is None
+		self.entries = deque(maxlen=max_entries)
+		self.spill_file = None
+		# Generations recorded, and how many of the oldest are in the spill file
+		self.num_entries = 0
+		self.num_written = 0
+		if append and spill_path is not None and os.path.exists(spill_path):
+			with open(spill_path) as f:
+				self.num_written = self.num_entries = sum(1 for _ in f)
+		# The spill file is replaced when first opened unless appending
+		self.append_to_file = append
+
+	def append(self, entry):
+		'''
+		Records the statistics of a generation.
+
+		entry -- dict of JSON-serializable summary statistics
+		'''
+		if len(self.entries) == self.max_entries:
+			# The oldest generation leaves memory, so it must be on disk
+			if self.num_written == self.num_entries - len(self.entries):
+				self.write(self.entries[0])
+		self.entries.append(entry)
+		self.num_entries += 1
+
+	def write(self, entry):
+		if self.spill_file is None:
+			if self.spill_path is None:
+				fd, self.spill_path = tempfile.mkstemp(prefix='history-', suffix='.jsonl')
+				os.close(fd)
+				weakref.finalize(self, os.remove, self.spill_path)
+			self.spill_file = open(self.spill_path, 'a' if self.append_to_file else 'w')
+			# Reopening after a close() adds to the file
+			self.append_to_file = True
+		self.spill_file.write(json.dumps(entry, separators=(',', ':')))
+		self.spill_file.write('\n')
+		self.num_written += 1
+
+	def __len__(self):
+		return self.num_entries
+
+	def __iter__(self):
+		'''
+		Iterates over every recorded generation, oldest first, reading
+		spilled generations back from disk.
+		'''
+		if self.num_written:
+			if self.spill_file is not None:
+				self.spill_file.flush()
+			with open(self.spill_path) as f:
+				for line in f:
+					yield json.loads(line)
+		# Generations in memory that are not in the file yet
+		first_unwritten = self.num_written - (self.num_entries - len(self.entries))
+		for entry in list(self.entries)[max(first_unwritten, 0):]:
+			yield entry
+
+	def recent(self):
+		'''
+		Returns the generations kept in memory, oldest first.
+		'''
+		return list(self.entries)
+
+	def last(self):
+		return self.entries[-1] if self.entries else None
+
+	def column(self, name):
+		'''
+		Returns one statistic of every recorded generation, oldest first.
+
+		name -- key of the statistic
+		'''
+		return [entry[name] for entry in self]
+
+	def close(self):
+		'''
+		Writes the generations still in memory to the spill file (if one was
+		given), then flushes and closes it.
+		'''
+		if not self.temporary:
+			first_unwritten = self.num_written - (self.num_entries - len(self.entries))
+			for entry in list(self.entries)[max(first_unwritten, 0):]:
+				self.write(entry)
+		if self.spill_file is not None:
+			self.spill_file.close()
+			self.spill_file = None
@@ -0,0 +1,257 @@
+'''
+Island model: several populations evolving in separate processes that
+periodically exchange their fittest genomes.
+
+Each island is a Population in its own worker process, so reproduction and
+speciation of the islands run in parallel. Every migration_interval
+generations each island sends copies of its fittest genomes to its
+neighbours in the migration topology, where they replace random offspring.
+Genomes travel between processes in the binary format of codec.py.
+'''
+import random
+import traceback
+import multiprocessing
+import numpy as np
+from deep_hyperneat.population import Population
+from deep_hyperneat.codec import encode_genome, decode_genome
+
+def ring_topology(num_islands):
+	'''
+	Each island sends migrants to the next island, and the last to the first.
+	Returns a list with the target islands of each island.
+	'''
+	if num_islands < 2:
+		return [[] for _ in range(num_islands)]
+	return [[(i+1) % num_islands] for i in range(num_islands)]
+
+def full_topology(num_islands):
+	'''
+	Each island sends migrants to every other island. Returns a list with
+	the target islands of each island.
+	'''
+	return [[j for j in range(num_islands) if j != i] for i in range(num_islands)]
+
+topologies = {'ring': ring_topology, 'full': full_topology}
+
+# Seconds an island is given to exit after being told to stop before it is
+#	terminated (e.g. when another island failed while it was evolving)
+stop_timeout = 10.0
+
+def island_worker(connection, key, size, elitism, task, seed):
+	'''
+	Runs one island. Receives commands from the IslandModel over a pipe and
+	answers each one with ('ok', result) or ('error', traceback).
+
+	connection -- worker end of the pipe
+	key 	   -- island (population) key
+	size 	   -- island population size
+	elitism    -- island elitism
+	task 	   -- task the island evolves on. Its close() method, if any, is
+				  called when the island stops (e.g. to shut down the worker
+				  pool of a ParallelEvaluator).
+	seed 	   -- optional seed for this island's random number generators. Without
+				  one, the generators are seeded from fresh entropy.
+	'''
+	if seed is not None:
+		random.seed(seed)
+		np.random.seed(seed)
+	else:
+		# Forked workers inherit the parent's generator states, so every island
+		#	would otherwise draw the same random numbers
+		random.seed()
+		np.random.seed()
+	population = None
+	try:
+		while True:
+			command, args = connection.recv()
+			if command == 'stop':
+				break
+			try:
+				if population is None:
+					population = Population(key, size, elitism)
+				if command == 'evolve':
+					result = evolve_island(population, task, *args)
+				elif command == 'emigrants':
+					result = [encode_genome(genome) for genome in population.emigrants(*args)]
+				elif command == 'immigrants':
+					population.accept_immigrants([decode_genome(data) for data in args[0]])
+					result = None
+				else:
+					raise ValueError("Unknown island command: {0!r}".format(command))
+				connection.send(('ok', result))
+			except Exception:
+				connection.send(('error', traceback.format_exc()))
+	finally:
+		close = getattr(task, 'close', None)
+		if close is not None:
+			close()
+		connection.close()
+
+def evolve_island(population, task, generations, goal):
+	'''
+	Evolves an island for a number of generations or until it reaches the
+	goal, and returns its statistics.
+
+	population  -- island population
+	task 		-- task to be solved
+	generations -- max number of generations
+	goal 		-- fitness goal
+	'''
+	for _ in range(generations):
+		population.step(task, report=False)
+		if population.best_genome.fitness >= goal:
+			break
+	return {'generation':population.current_gen,
+			'best_genome':encode_genome(population.best_genome),
+			'max_complexity':population.max_complex_genome.complexity(),
+			'min_complexity':population.min_complex_genome.complexity(),
+			'avg_complexity':population.avg_complex}
+
+class IslandModel:
+
+	def __init__(self, num_islands, island_size, elitism=1, topology='ring',
+				 migration_interval=5, num_migrants=2, seed=None):
+		'''
+		Runs several populations in worker processes with migration between them.
+
+		num_islands 	   -- number of islands (worker processes)
+		island_size 	   -- population size of each island
+		elitism 		   -- elitism of each island
+		topology 		   -- 'ring', 'full', or a function taking the number of
+							  islands and returning each island's target islands
+		migration_interval -- number of generations between migrations
+		num_migrants 	   -- number of genomes each island sends to each target
+		seed 			   -- optional base seed; island i is seeded with seed+i. Without
+							  one, each island is seeded from fresh entropy.
+		'''
+		self.num_islands = num_islands
+		self.island_size = island_size
+		self.elitism = elitism
+		if not callable(topology):
+			if topology not in topologies:
+				raise ValueError("Unknown migration topology: {0!r}".format(topology))
+			topology = topologies[topology]
+		self.targets = topology(num_islands)
+		self.migration_interval = migration_interval
+		self.num_migrants = num_migrants
+		self.seed = seed
+		self.best_genome = None
+		# Island the best genome was found on (genome keys are per island)
+		self.best_island = None
+		self.current_gen = 0
+		# Global statistics after each migration interval
+		self.history = []
+
+	def run(self, task, goal, generations):
+		'''
+		Evolves the islands for a number of generations or until one of them
+		reaches the goal. Returns the best genome found on any island.
+
+		task 		-- picklable task to be solved (see Population.run). Islands are
+					   not daemon processes, so a ParallelEvaluator task gives
+					   each island its own worker pool.
+		goal 		-- the goal to reach for the given task that defines a solution
+		generations -- the max number of generations to run evolution for
+		'''
+		connections, processes = [], []
+		for i in range(self.num_islands):
+			parent_end, worker_end = multiprocessing.Pipe()
+			seed = None if self.seed is None else self.seed + i
+			process = multiprocessing.Process(target=island_worker,
+											  args=(worker_end, i, self.island_size,
+													self.elitism, task, seed))
+			process.start()
+			worker_end.close()
+			connections.append(parent_end)
+			processes.append(process)
+		try:
+			start_gen = self.current_gen
+			reached_goal = False
+			while self.current_gen - start_gen < generations and not reached_goal:
+				interval = min(self.migration_interval, generations - (self.current_gen - start_gen))
+				stats = self.broadcast(connections, 'evolve', interval, goal)
+				self.update_statistics(stats)
+				self.report()
+				reached_goal = self.best_genome.fitness >= goal
+				if not reached_goal and self.current_gen - start_gen < generations:
+					self.migrate(connections)
+		finally:
+			for connection in connections:
+				try:
+					connection.send(('stop', ()))
+				except OSError:
+					# The worker has already exited
+					pass
+				connection.close()
+			# Islands are not daemons (they may start worker pools), so any
+			#	still busy are terminated rather than left running
+			for process in processes:
+				process.join(stop_timeout)
+				if process.is_alive():
+					process.terminate()
+					process.join()
+		return self.best_genome
+
+	def broadcast(self, connections, command, *args):
+		'''
+		Sends a command to every island and returns their results in island order.
+		'''
+		for connection in connections:
+			connection.send((command, args))
+		return [self.receive(connection) for connection in connections]
+
+	def receive(self, connection):
+		status, result = connection.recv()
+		if status == 'error':
+			raise RuntimeError("Island failed:\n" + result)
+		return result
+
+	def migrate(self, connections):
+		'''
+		Sends the fittest genomes of each island to its target islands.
+		'''
+		emigrants = self.broadcast(connections, 'emigrants', self.num_migrants)
+		immigrants = [[] for _ in connections]
+		for source, targets in enumerate(self.targets):
+			for target in targets:
+				immigrants[target].extend(emigrants[source])
+		for connection, genomes in zip(connections, immigrants):
+			connection.send(('immigrants', (genomes,)))
+		for connection in connections:
+			self.receive(connection)
+
+	def update_statistics(self, stats):
+		'''
+		Updates the global best genome and complexity statistics from the
+		statistics of each island.
+		'''
+		island_bests = [decode_genome(s['best_genome']) for s in stats]
+		for island, genome in enumerate(island_bests):
+			if self.best_genome is None or genome.fitness > self.best_genome.fitness:
+				self.best_genome = genome
+				self.best_island = island
+		self.current_gen = max(s['generation'] for s in stats)
+		self.history.append({'generation':self.current_gen,
+							 'best_fitness':self.best_genome.fitness,
+							 'island_best_fitness':[genome.fitness for genome in island_bests],
+							 'max_complexity':max(s['max_complexity'] for s in stats),
+							 'min_complexity':min(s['min_complexity'] for s in stats),
+							 'avg_complexity':float(np.mean([s['avg_complexity'] for s in stats]))})
+
+	def report(self):
+		'''
+		Reports global statistics after a migration interval.
+		'''
+		stats = self.history[-1]
+		print("\n=================================================")
+		print("\t\tGeneration: {}".format(stats['generation']))
+		print("=================================================")
+		print("Best Fitness \t Champion (Island/Key) \t Island Best Fitnesses")
+		print("============ \t ===================== \t =====================")
+		print("{:.2f} \t\t {}/{} \t\t\t {}".format(stats['best_fitness'], self.best_island, self.best_genome.key,
+			  " ".join("{:.2f}".format(f) for f in stats['island_best_fitness'])))
+		print("=================================================")
+		print("Max Complexity \t Min Complexity \t Avg Complexity")
+		print("============== \t ============== \t ==============")
+		print("{} \t\t {} \t\t\t {:.2f}".format(stats['max_complexity'], stats['min_complexity'],
+			  stats['avg_complexity']))
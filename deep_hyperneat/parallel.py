@@ -0,0 +1,66 @@
+'''
+Evaluates the fitness of a population in parallel worker processes.
+
+Modeled on the parallel evaluator of neat-python. (Copyright 2015-2017, CodeReclaimers, LLC.)
+'''
+import multiprocessing
+from math import ceil
+
+class ParallelEvaluator:
+
+	def __init__(self, eval_function, num_workers=None, chunksize=None, pool=None):
+		'''
+		Shards a population across a pool of worker processes that compute
+		each genome's fitness. An instance is a task for Population.run().
+
+		eval_function -- picklable function taking a genome and returning its fitness
+		num_workers   -- optional number of worker processes (defaults to the CPU count)
+		chunksize     -- optional number of genomes sent to a worker at a time
+						 (defaults to about four chunks per worker)
+		pool		  -- optional existing multiprocessing pool to evaluate in
+		'''
+		self.eval_function = eval_function
+		self.num_workers = num_workers if num_workers else multiprocessing.cpu_count()
+		self.chunksize = chunksize
+		self.pool = pool
+		# Only pools created here are closed by close()
+		self.owns_pool = pool is None
+
+	def __call__(self, genomes):
+		'''
+		Assigns the fitness of each genome.
+
+		genomes -- list of (genome key, genome) tuples
+		'''
+		members = [genome for _, genome in genomes]
+		if self.num_workers == 1 and self.owns_pool:
+			fitnesses = [self.eval_function(genome) for genome in members]
+		else:
+			# Workers are created once and reused across generations
+			if self.pool is None:
+				self.pool = multiprocessing.Pool(self.num_workers)
+			fitnesses = self.pool.map(self.eval_function, members,
+									  self.get_chunksize(len(members)))
+		# Write fitnesses back to the parent's genomes
+		for genome, fitness in zip(members, fitnesses):
+			genome.fitness = fitness
+
+	def get_chunksize(self, num_genomes):
+		if self.chunksize:
+			return self.chunksize
+		return max(1, int(ceil(num_genomes/(self.num_workers*4.0))))
+
+	def close(self):
+		'''
+		Shuts down the worker processes.
+		'''
+		if self.pool is not None and self.owns_pool:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -4,18 +4,33 @@ Contains classes for CPPN and Substrate phenomes.
 Largely copied from neat-python. (Copyright 2015-2017, CodeReclaimers, LLC.)
 '''
 
-from deep_hyperneat.util import itervalues
+from deep_hyperneat.util import iteritems, itervalues
+from deep_hyperneat.activations import vectorized
 import numpy as np
 
-def creates_cycle(connections, test):
+def creates_cycle(connections, test, outgoing=None):
     """
     Returns true if the addition of the 'test' connection would create a cycle,
     assuming that no cycle already exists in the graph represented by 'connections'.
+    If 'outgoing' (a dict of node identifiers to their target nodes) is given, the
+    search follows it instead of scanning 'connections', visiting each edge once.
     """
     i, o = test
     if i == o:
         return True
 
+    if outgoing is not None:
+        visited = {o}
+        stack = [o]
+        while stack:
+            for b in outgoing.get(stack.pop(), ()):
+                if b == i:
+                    return True
+                if b not in visited:
+                    visited.add(b)
+                    stack.append(b)
+        return False
+
     visited = {o}
     while True:
         num_added = 0
@@ -30,34 +45,44 @@ def creates_cycle(connections, test):
         if num_added == 0:
             return False
 
-def required_for_output(inputs, outputs, connections):
+def required_for_output(inputs, outputs, connections, incoming=None):
     """
     Collect the nodes whose state is required to compute the final network output(s).
     :param inputs: list of the input identifiers
     :param outputs: list of the output node identifiers
     :param connections: list of (input, output) connections in the network.
+    :param incoming: optional dict of node identifiers to the list of their source nodes,
+        as built by incoming_index(connections).
     NOTE: It is assumed that the input identifier set and the node identifier set are disjoint.
     By convention, the output node ids are always the same as the output index.
 
     Returns a set of identifiers of required nodes.
     """
+    if incoming is None:
+        incoming = incoming_index(connections)
+    inputs = set(inputs)
     required = set(outputs)
-    s = set(outputs)
-    while 1:
-        # Find nodes not in S whose output is consumed by a node in s.
-        t = set(a for (a, b) in connections if b in s and a not in s)
-
-        if not t:
-            break
-
-        layer_nodes = set(x for x in t if x not in inputs)
-        if not layer_nodes:
-            break
+    # Walk backwards from the outputs, visiting every edge once
+    stack = list(required)
+    while stack:
+        node = stack.pop()
+        for a in incoming.get(node, ()):
+            if a not in required and a not in inputs:
+                required.add(a)
+                stack.append(a)
+    return required
 
-        required = required.union(layer_nodes)
-        s = s.union(t)
+def incoming_index(connections):
+    """
+    Index a list of (input, output) connections by their output node.
 
-    return required
+    Returns a dict of node identifiers to the list of their source nodes, in
+    the order the connections were given.
+    """
+    incoming = {}
+    for a, b in connections:
+        incoming.setdefault(b, []).append(a)
+    return incoming
 
 def feed_forward_layers(inputs, outputs, connections):
     """
@@ -70,31 +95,48 @@ def feed_forward_layers(inputs, outputs, connections):
     Note that the returned layers do not contain nodes whose output is ultimately
     never used to compute the final network output.
     """
+    layers, _ = feed_forward_layers_indexed(inputs, outputs, connections)
+    return layers
+
+def feed_forward_layers_indexed(inputs, outputs, connections):
+    """
+    Same as feed_forward_layers(), but runs in O(V+E) time using Kahn-style
+    layering over adjacency indices, and also returns the incoming-edge index.
 
-    required = required_for_output(inputs, outputs, connections)
+    Returns (layers, incoming), where incoming is a dict of node identifiers to
+    the list of their source nodes (see incoming_index()).
+    """
+    incoming = incoming_index(connections)
+    outgoing = {}
+    for a, b in connections:
+        outgoing.setdefault(a, []).append(b)
+    required = required_for_output(inputs, outputs, connections, incoming)
 
+    # Number of sources of each node that have not been evaluated yet
+    remaining = {b:len(sources) for b, sources in iteritems(incoming)}
     layers = []
     s = set(inputs)
+    frontier = s
     while 1:
-        # Find candidate nodes c for the next layer.  These nodes should connect
-        # a node in s to a node not in s.
-        c = set(b for (a, b) in connections if a in s and b not in s)
-        # Keep only the used nodes whose entire input set is contained in s.
+        # A used node joins the next layer once its entire input set is in s.
         t = set()
-        for n in c:
-            if n in required and all(a in s for (a, b) in connections if b == n):
-                t.add(n)
+        for a in frontier:
+            for b in outgoing.get(a, ()):
+                remaining[b] -= 1
+                if remaining[b] == 0 and b in required and b not in s:
+                    t.add(b)
 
         if not t:
             break
 
         layers.append(t)
         s = s.union(t)
+        frontier = t
 
-    return layers
+    return layers, incoming
 
 class FeedForwardCPPN():
-    def __init__(self, inputs, outputs, node_evals, nodes=None, mapping_tuples=None):
+    def __init__(self, inputs, outputs, node_evals, nodes=None, mapping_tuples=None, activations=None):
         '''
         Feed forward representation of a CPPN.
 
@@ -103,12 +145,15 @@ class FeedForwardCPPN():
         node_evals -- objects containing information for each node
         nodes      -- all nodes of CPPN
         mapping_tuples -- mapping tuples associated with each output node
+        activations -- optional ActivationFunctionSet the activation functions are registered on
         '''
         self.input_nodes = inputs
         self.output_nodes = {key:mapping_tuples[key] for key in mapping_tuples} if mapping_tuples else outputs
         self.node_evals = node_evals
         self.values = {key:0.0 for key in list(inputs) + list(outputs)}
         self.nodes = nodes
+        self.activations = activations
+        self.program = None
 
     def activate(self, inputs):
         if len(self.input_nodes) != len(inputs):
@@ -125,22 +170,39 @@ class FeedForwardCPPN():
             self.values[node] = act_func(s)
         return self.values
 
+    def activate_batch(self, inputs):
+        '''
+        Activates the CPPN on a batch of queries at once using its compiled
+        array program (see compile()).
+
+        inputs -- array of shape (N, number of inputs), one query per row
+
+        Returns a dictionary of output node ids to arrays of N values.
+        '''
+        program = self.program if self.program is not None else self.compile()
+        outputs = program.activate(inputs)
+        return {key:outputs[:, col] for key, col in program.output_index.items()}
+
+    def compile(self):
+        '''
+        Compiles the CPPN's node evaluations into a CPPNProgram and caches it.
+        '''
+        self.program = CPPNProgram(self.input_nodes, list(self.output_nodes), self.node_evals,
+                                   self.activations)
+        return self.program
+
     @staticmethod
     def create(genome):
         connections = [cg.key for cg in itervalues(genome.connections) if cg.enabled]
-        layers = feed_forward_layers(genome.input_keys, genome.output_keys, connections)
+        layers, incoming = feed_forward_layers_indexed(genome.input_keys, genome.output_keys, connections)
         mapping_tuples = {}
         node_evals = []
         # Traverse layers
         for layer in layers:
             # For each node in each layer, collect all incoming connections to the node
             for node in layer:
-                incoming_connections = []
-                for conn_key in connections:
-                    input_node, output_node = conn_key
-                    if output_node == node:
-                        cg = genome.connections[conn_key]
-                        incoming_connections.append((input_node, cg.weight))
+                incoming_connections = [(input_node, genome.connections[(input_node, node)].weight)
+                                        for input_node in incoming[node]]
                 # Gather node gene information
                 node_gene = genome.nodes[node]
                 activation_function = node_gene.activation
@@ -150,15 +212,94 @@ class FeedForwardCPPN():
             mapping_tuples[key] = genome.nodes[key].cppn_tuple
         for key in genome.bias_keys:
             mapping_tuples[key] = genome.nodes[key].cppn_tuple
-        return FeedForwardCPPN(genome.input_keys, genome.output_keys, node_evals, genome.nodes, mapping_tuples)
+        return FeedForwardCPPN(genome.input_keys, genome.output_keys, node_evals, genome.nodes, mapping_tuples,
+                               genome.activations)
+
+class CPPNProgram():
+    def __init__(self, inputs, outputs, node_evals, activations=None):
+        '''
+        Array program compiled from the topologically ordered node evaluations
+        of a FeedForwardCPPN. Every node is assigned an integer slot in a value
+        matrix, nodes are grouped into levels whose inputs are all available,
+        and within each level nodes sharing an activation function are
+        evaluated together with a single matrix product.
+
+        inputs     -- input nodes of CPPN
+        outputs    -- output nodes of CPPN, in the order of the returned columns
+        node_evals -- node evaluations as built by FeedForwardCPPN.create()
+        activations -- optional ActivationFunctionSet the activation functions are registered on
+        '''
+        vectorize = activations.vectorized if activations is not None else vectorized
+        self.num_inputs = len(inputs)
+        self.slots = {key:slot for slot, key in enumerate(inputs)}
+        level = {key:0 for key in inputs}
+        levels = []
+        for node, act_func, agg_func, incoming_connections in node_evals:
+            self.slots[node] = len(self.slots)
+            node_level = 1 + max([level[node_id] for node_id, _ in incoming_connections] + [0])
+            level[node] = node_level
+            if node_level > len(levels):
+                levels.append({})
+            # Group nodes of each level by activation function
+            levels[node_level-1].setdefault(act_func, []).append((node, incoming_connections))
+        # Outputs that are never evaluated keep a zero valued slot
+        for key in outputs:
+            if key not in self.slots:
+                self.slots[key] = len(self.slots)
+        self.output_index = {key:col for col, key in enumerate(outputs)}
+        self.output_slots = np.array([self.slots[key] for key in outputs], dtype=int)
+        # Each step is (target slots, source slots, weight matrix, activation)
+        self.steps = []
+        for groups in levels:
+            for act_func, group in groups.items():
+                sources = sorted({self.slots[node_id] for _, incoming in group for node_id, _ in incoming})
+                source_index = {slot:row for row, slot in enumerate(sources)}
+                weights = np.zeros((len(sources), len(group)))
+                for col, (node, incoming_connections) in enumerate(group):
+                    for node_id, conn_weight in incoming_connections:
+                        weights[source_index[self.slots[node_id]], col] += conn_weight
+                targets = np.array([self.slots[node] for node, _ in group], dtype=int)
+                self.steps.append((targets, np.array(sources, dtype=int), weights,
+                                   vectorize(act_func)))
+
+    def activate(self, inputs):
+        '''
+        Evaluates the program on a batch of queries.
+
+        inputs -- array of shape (N, number of inputs), one query per row
+
+        Returns an array of shape (N, number of outputs).
+        '''
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or self.num_inputs != inputs.shape[1]:
+            raise RuntimeError("Expected {0:n} inputs per row, got shape {1}".format(
+                                self.num_inputs, inputs.shape))
+        values = np.zeros((len(inputs), len(self.slots)))
+        values[:, :self.num_inputs] = inputs
+        for targets, sources, weights, act_func in self.steps:
+            values[:, targets] = act_func(values[:, sources].dot(weights))
+        return values[:, self.output_slots]
 
 class FeedForwardSubstrate():
-    def __init__(self, inputs, bias, outputs, node_evals):
+    def __init__(self, inputs, bias, outputs, node_evals, layers=None, activations=None):
+        '''
+        Feed forward representation of a Substrate.
+
+        inputs     -- input nodes of Substrate
+        bias       -- bias node of Substrate
+        outputs    -- output nodes of Substrate
+        node_evals -- objects containing information for each node, in reverse evaluation order
+        layers     -- optional node ids of each substrate layer, from bottom to top
+        activations -- optional ActivationFunctionSet the activation functions are registered on
+        '''
         self.input_nodes = inputs
         self.bias_node = bias
         self.output_nodes = outputs
         self.node_evals = node_evals
+        self.layers = layers
+        self.activations = activations
         self.values = dict((key, 0.0) for key in inputs + outputs)
+        self.dense = None
 
     def activate(self, inputs):
         if len(self.input_nodes+self.bias_node) != len(inputs):
@@ -176,23 +317,183 @@ class FeedForwardSubstrate():
             self.values[node] = act_func(s)
         return [self.values[i] for i in self.output_nodes]
 
+    def activate_batch(self, inputs):
+        '''
+        Activates the Substrate on a batch of inputs at once using its dense
+        layer-matrix representation (see DenseSubstrate).
+
+        inputs -- array of shape (N, number of inputs + 1), bias value last
+
+        Returns an array of shape (N, number of outputs).
+        '''
+        if self.dense is None:
+            self.dense = DenseSubstrate.create(self)
+        return self.dense.activate_batch(inputs)
+
     @staticmethod
     def create(genome):
         connections = [cg.key for cg in itervalues(genome.connections) if cg.enabled]
-        layers = feed_forward_layers(genome.input_keys, genome.output_keys, connections)
+        layers, incoming = feed_forward_layers_indexed(genome.input_keys, genome.output_keys, connections)
         node_evals = []
         # Traverse layers
         for layer in layers:
             # For each node in each layer, collect all incoming connections to the node
             for node in layer:
-                inputs = []
-                for conn_key in connections:
-                    input_node, output_node = conn_key
-                    if output_node == node:
-                        cg = genome.connections[conn_key]
-                        inputs.append((input_node, cg.weight))
+                inputs = [(input_node, genome.connections[(input_node, node)].weight)
+                          for input_node in incoming[node]]
                 # Gather node gene information
                 node_gene = genome.nodes[node]
                 activation_function = node_gene.activation
                 node_evals.append((node, activation_function, node_gene.bias, inputs))
         return FeedForwardCPPN(genome.input_keys, genome.bias_key, genome.output_keys, node_evals, genome.nodes)
+
+class DenseSubstrate():
+    def __init__(self, inputs, bias, outputs, num_nodes, layers):
+        '''
+        Layer-matrix representation of a Substrate. Each substrate layer is
+        stored as a weight matrix over the nodes feeding it and a bias vector.
+
+        inputs    -- input nodes of Substrate
+        bias      -- bias node of Substrate
+        outputs   -- output nodes of Substrate
+        num_nodes -- total number of nodes in the Substrate
+        layers    -- list of (node ids, source ids, weight matrix, bias vector,
+                     activation function), from bottom to top
+        '''
+        self.input_nodes = inputs
+        self.bias_node = bias
+        self.output_nodes = outputs
+        self.num_nodes = num_nodes
+        self.layers = layers
+
+    def activate(self, inputs):
+        return self.activate_batch([inputs])[0].tolist()
+
+    def activate_batch(self, inputs):
+        '''
+        Activates the Substrate on a batch of inputs.
+
+        inputs -- array of shape (N, number of inputs + 1), bias value last
+
+        Returns an array of shape (N, number of outputs).
+        '''
+        inputs = np.asarray(inputs, dtype=float)
+        num_inputs = len(self.input_nodes+self.bias_node)
+        if inputs.ndim != 2 or num_inputs != inputs.shape[1]:
+            raise RuntimeError("Expected {0:n} inputs per row, got shape {1}".format(
+                                num_inputs, inputs.shape))
+        values = np.zeros((len(inputs), self.num_nodes))
+        values[:, self.input_nodes] = inputs[:, :len(self.input_nodes)]
+        bias_values = inputs[:, -1:]
+        for nodes, sources, weights, bias, act_func in self.layers:
+            values[:, nodes] = act_func(values[:, sources].dot(weights) + bias_values*bias)
+        return values[:, self.output_nodes]
+
+    @staticmethod
+    def create(substrate):
+        '''
+        Builds the layer matrices of a FeedForwardSubstrate.
+
+        substrate -- FeedForwardSubstrate to convert
+        '''
+        vectorize = substrate.activations.vectorized if substrate.activations is not None else vectorized
+        bias_id = substrate.bias_node[0]
+        evals = {node_eval[0]:node_eval for node_eval in substrate.node_evals}
+        layers = substrate.layers
+        if layers is None:
+            # Group nodes by dependency depth when no layering was recorded
+            depth = {key:0 for key in substrate.input_nodes+substrate.bias_node}
+            layers = []
+            for node, act_func, agg_func, links in substrate.node_evals[::-1]:
+                depth[node] = 1 + max([depth[i] for i, w in links] + [0])
+                if depth[node] > len(layers):
+                    layers.append([])
+                layers[depth[node]-1].append(node)
+        num_nodes = 1 + max(list(evals) + substrate.input_nodes + substrate.bias_node + substrate.output_nodes)
+        dense_layers = []
+        for layer in layers:
+            # Nodes within a layer sharing an activation function form one matrix
+            groups = {}
+            for node in layer:
+                groups.setdefault(evals[node][1], []).append(node)
+            for act_func, nodes in groups.items():
+                sources = sorted({i for node in nodes for i, w in evals[node][3] if i != bias_id})
+                source_index = {i:row for row, i in enumerate(sources)}
+                weights = np.zeros((len(sources), len(nodes)))
+                bias = np.zeros(len(nodes))
+                for col, node in enumerate(nodes):
+                    for i, w in evals[node][3]:
+                        if i == bias_id:
+                            bias[col] += w
+                        else:
+                            weights[source_index[i], col] += w
+                dense_layers.append((np.array(nodes, dtype=int), np.array(sources, dtype=int),
+                                     weights, bias, vectorize(act_func)))
+        return DenseSubstrate(substrate.input_nodes, substrate.bias_node,
+                              substrate.output_nodes, num_nodes, dense_layers)
+
+class SparseSubstrate():
+    def __init__(self, inputs, bias, outputs, node_evals, layers, activations=None):
+        '''
+        Sparse representation of a Substrate. Each substrate layer only stores
+        its expressed links, in compressed sparse row (CSR) form.
+
+        inputs     -- input nodes of Substrate
+        bias       -- bias node of Substrate
+        outputs    -- output nodes of Substrate
+        node_evals -- (node, activation, aggregation, (source ids, weights)) for each node
+        layers     -- node ids of each substrate layer, from bottom to top
+        activations -- optional ActivationFunctionSet the activation functions are registered on
+        '''
+        vectorize = activations.vectorized if activations is not None else vectorized
+        self.input_nodes = inputs
+        self.bias_node = bias
+        self.output_nodes = outputs
+        evals = {node_eval[0]:node_eval for node_eval in node_evals}
+        self.num_nodes = 1 + max(list(evals) + inputs + bias + outputs)
+        self.num_links = 0
+        # Each entry is (node ids, row pointers, source ids, weights, activation)
+        self.layers = []
+        for layer in layers:
+            groups = {}
+            for node in layer:
+                groups.setdefault(evals[node][1], []).append(node)
+            for act_func, nodes in groups.items():
+                links = [evals[node][3] for node in nodes]
+                indptr = np.zeros(len(nodes)+1, dtype=int)
+                indptr[1:] = np.cumsum([len(ids) for ids, _ in links])
+                indices = np.concatenate([ids for ids, _ in links]).astype(int)
+                data = np.concatenate([w for _, w in links]).astype(float)
+                self.num_links += len(data)
+                self.layers.append((np.array(nodes, dtype=int), indptr, indices, data,
+                                    vectorize(act_func)))
+
+    def activate(self, inputs):
+        return self.activate_batch([inputs])[0].tolist()
+
+    def activate_batch(self, inputs):
+        '''
+        Activates the Substrate on a batch of inputs.
+
+        inputs -- array of shape (N, number of inputs + 1), bias value last
+
+        Returns an array of shape (N, number of outputs).
+        '''
+        inputs = np.asarray(inputs, dtype=float)
+        num_inputs = len(self.input_nodes+self.bias_node)
+        if inputs.ndim != 2 or num_inputs != inputs.shape[1]:
+            raise RuntimeError("Expected {0:n} inputs per row, got shape {1}".format(
+                                num_inputs, inputs.shape))
+        values = np.zeros((len(inputs), self.num_nodes))
+        values[:, self.input_nodes] = inputs[:, :len(self.input_nodes)]
+        values[:, self.bias_node[0]] = inputs[:, -1]
+        for nodes, indptr, indices, data, act_func in self.layers:
+            sums = np.zeros((len(inputs), len(nodes)))
+            # Only expressed links are multiplied; rows without links sum to zero
+            nonempty = indptr[1:] > indptr[:-1]
+            if data.size:
+                products = values[:, indices] * data
+                sums[:, nonempty] = np.add.reduceat(products, indptr[:-1][nonempty], axis=1)
+            values[:, nodes] = act_func(sums)
+        return values[:, self.output_nodes]
+
@@ -3,22 +3,99 @@ Population class for Deep HyperNEAT
 
 Felix Sosa
 '''
+import os
+import random
+import struct
+import inspect
+from time import perf_counter
+from contextlib import contextmanager
 import numpy as np
 from deep_hyperneat.genome import Genome
+from deep_hyperneat.codec import write_genome, read_genome, GenomeCodecError
+from deep_hyperneat.profiling import profiler
 from deep_hyperneat.reproduction import Reproduction
 from deep_hyperneat.util import iteritems,itervalues
 from deep_hyperneat.species import SpeciesSet
-from deep_hyperneat.reporters import report_fitness, report_species, plot_fitness, report_output
+from deep_hyperneat.reporters import ReporterSet, default_reporters
+from deep_hyperneat.history import RunHistory
+
+# Checkpoint file header: magic, version, size, elitism, current generation,
+#	next genome key, whether a best genome follows and the number of genomes.
+#	The population key follows the header.
+CHECKPOINT_VERSION = 2
+CHECKPOINT_MAGIC = b'DHNC'
+checkpoint_format = struct.Struct('<4sHqqqqBI')
+# Population keys are stored as a type tag followed by an int64, or by a
+#	length-prefixed UTF-8 string
+INT_KEY, STR_KEY = 0, 1
+key_tag_format = struct.Struct('<B')
+int_key_format = struct.Struct('<q')
+str_length_format = struct.Struct('<I')
+
+def pack_population_key(key):
+	'''
+	Returns the checkpoint record of a population key.
+
+	key -- int or string population key
+	'''
+	if isinstance(key, str):
+		data = key.encode('utf-8')
+		return key_tag_format.pack(STR_KEY) + str_length_format.pack(len(data)) + data
+	if isinstance(key, (int, np.integer)) and not isinstance(key, bool):
+		if -2**63 <= key < 2**63:
+			return key_tag_format.pack(INT_KEY) + int_key_format.pack(key)
+	raise GenomeCodecError("Population key {0!r} cannot be checkpointed; "
+						   "use an int64 or a string.".format(key))
+
+def read_exactly(stream, size):
+	data = stream.read(size)
+	if len(data) != size:
+		raise GenomeCodecError("Truncated checkpoint.")
+	return data
+
+def read_population_key(stream):
+	'''
+	Reads a population key written by pack_population_key from a binary stream.
+
+	stream -- readable binary file object
+	'''
+	(tag,) = key_tag_format.unpack(read_exactly(stream, key_tag_format.size))
+	if tag == INT_KEY:
+		return int_key_format.unpack(read_exactly(stream, int_key_format.size))[0]
+	if tag == STR_KEY:
+		(length,) = str_length_format.unpack(read_exactly(stream, str_length_format.size))
+		return read_exactly(stream, length).decode('utf-8')
+	raise GenomeCodecError("Unknown population key type: {0}".format(tag))
+
+def as_task(task):
+	'''
+	Returns a task for Population.run, wrapping coroutine functions in an
+	AsyncEvaluator.
+
+	task -- task function or coroutine function
+	'''
+	if inspect.iscoroutinefunction(task):
+		# Imported here to keep asyncio off the import path
+		from deep_hyperneat.asynchronous import AsyncEvaluator
+		task = AsyncEvaluator(task)
+	return task
 
 class Population():
 
-	def __init__(self, key, size, elitism=1, state=None):
+	def __init__(self, key, size, elitism=1, state=None, reporters=None, history=None):
 		'''
 		Class for populations.
 
-		key		-- population key
-		size 	-- population size
-		elitism -- number of members that must be passed from previous gen to next gen
+		key		  -- population key
+		size 	  -- population size
+		elitism   -- number of members that must be passed from previous gen to next gen
+		state 	  -- optional (population, reproduction) to resume from
+		reporters -- optional list of reporter plugins (see reporters.py). Defaults
+					 to printing statistics each generation and plotting the
+					 best fitness at the end of a run.
+		history   -- optional RunHistory recording each generation's statistics
+					 (defaults to keeping the last 1000 generations in memory and
+					 older ones in a temporary file)
 		'''
 		self.key = key
 		self.size = size
@@ -26,12 +103,16 @@ class Population():
 		self.max_complex_genome = None
 		self.min_complex_genome = None
 		self.avg_complexity = None
-		self.max_dict = {}
+		self.history = RunHistory() if history is None else history
+		self.evaluated_population = {}
+		# Seconds spent in each phase of the last generation
+		self.phase_times = {}
 		self.last_best = 0
 		self.current_gen = 0
 		self.elitism = elitism
 		self.reproduction = Reproduction()
 		self.species = SpeciesSet(3.5)
+		self.reporters = ReporterSet(default_reporters() if reporters is None else reporters)
 
 		if state == None:
 			# Create new population
@@ -40,83 +121,228 @@ class Population():
 		else:
 			# Assign values from state
 			self.population, self.reproduction = state
+			self.species.speciate(self.population,0)
 
-	def run(self,task,goal,generations=None):
+	def run(self,task,goal,generations=None,trace_path=None):
 		'''
 		Run evolution on a given task for a number of generations or until
 		a goal is reached.
 
-		task -- the task to be solved
+		task -- the task to be solved: a function assigning the fitness of a list of
+				(genome key, genome) pairs, or a coroutine function returning the
+				fitness of one genome (run through an AsyncEvaluator)
 		goal -- the goal to reach for the given task that defines a solution
 		generations -- the max number of generations to run evolution for
+		trace_path  -- optional file to write a profile of the run to, as JSON
+					   lines if it ends in .jsonl and as a Chrome trace otherwise
 		'''
-		self.current_gen = 0
-		reached_goal = False
-		# Plot data
-		best_fitnesses = []
-		max_complexity = []
-		min_complexity = []
-		avg_complexity = []
-		while self.current_gen < generations and not reached_goal:
+		if trace_path is not None:
+			was_enabled = profiler.enabled
+			profiler.reset()
+			profiler.enable()
+		try:
+			task = as_task(task)
+			start_gen = self.current_gen
+			reached_goal = False
+			while self.current_gen - start_gen < generations and not reached_goal:
+				self.step(task)
+
+				# Reached fitness goal, we can stop
+				if self.best_genome.fitness >= goal:
+					reached_goal = True
+
+			self.reporters.end_run(self)
+			self.history.close()
+		finally:
+			# An interrupted run still writes the generations profiled so far
+			if trace_path is not None:
+				profiler.enabled = was_enabled
+				profiler.write_trace(trace_path)
+		return self.best_genome
+
+	def step(self,task,report=True):
+		'''
+		Runs one generation: evaluates the population on a task, updates the
+		best and complexity statistics, then reproduces and speciates the next
+		generation.
+
+		task   -- the task to be solved (see run())
+		report -- optional flag for printing the generation's reports
+		'''
+		task = as_task(task)
+		self.phase_times = {}
+		with self.phase('generation', generation=self.current_gen):
 			# Assess fitness of current population
-			task(list(iteritems(self.population)))
-			# Find best genome in current generation and update avg fitness
-			curr_best = None
-			curr_max_complex = None
-			curr_min_complex = None
-			avg_complexities = 0
-			for genome in itervalues(self.population):
-				avg_complexities += genome.complexity()
-				# Update generation's most fit
-				if curr_best is None or genome.fitness > curr_best.fitness:
-					curr_best = genome
-				# Update generation's most complex
-				if curr_max_complex is None or genome.complexity() > curr_max_complex.complexity():
-					curr_max_complex = genome
-				# Update generation's least complex
-				if curr_min_complex is None or genome.complexity() < curr_min_complex.complexity():
-					curr_min_complex = genome
-
-			# Update global best genome if possible
-			if self.best_genome is None or curr_best.fitness > self.best_genome.fitness:
-				self.best_genome = curr_best
-
-			# Update global most and least complex genomes
-			if self.max_complex_genome is None or curr_max_complex.complexity() > self.max_complex_genome.complexity():
-				self.max_complex_genome = curr_max_complex
-			if self.min_complex_genome is None or curr_min_complex.complexity() < self.min_complex_genome.complexity():
-				self.min_complex_genome = curr_min_complex
-
-			self.max_dict[self.current_gen] = self.max_complex_genome
+			with self.phase('evaluate'):
+				# Drop phenomes of genomes that have left the population from
+				#	the task's cache, if it has one
+				cache = getattr(task, 'phenotype_cache', None)
+				if cache is not None:
+					cache.retain(list(itervalues(self.population)) +
+								 ([self.best_genome] if self.best_genome is not None else []))
+				task(list(iteritems(self.population)))
+			with self.phase('statistics'):
+				# Find best genome in current generation and update avg fitness
+				curr_best = None
+				curr_max_complex = None
+				curr_min_complex = None
+				avg_complexities = 0
+				for genome in itervalues(self.population):
+					avg_complexities += genome.complexity()
+					# Update generation's most fit
+					if curr_best is None or genome.fitness > curr_best.fitness:
+						curr_best = genome
+					# Update generation's most complex
+					if curr_max_complex is None or genome.complexity() > curr_max_complex.complexity():
+						curr_max_complex = genome
+					# Update generation's least complex
+					if curr_min_complex is None or genome.complexity() < curr_min_complex.complexity():
+						curr_min_complex = genome
+
+				# Update global best genome if possible
+				if self.best_genome is None or curr_best.fitness > self.best_genome.fitness:
+					self.best_genome = curr_best
+
+				# Update global most and least complex genomes
+				if self.max_complex_genome is None or curr_max_complex.complexity() > self.max_complex_genome.complexity():
+					self.max_complex_genome = curr_max_complex
+				if self.min_complex_genome is None or curr_min_complex.complexity() < self.min_complex_genome.complexity():
+					self.min_complex_genome = curr_min_complex
+
+				self.avg_complex = (avg_complexities+0.0)/len(self.population)
+				self.history.append({'generation':self.current_gen,
+									 'best_fitness':float(self.best_genome.fitness),
+									 'best_key':self.best_genome.key,
+									 'max_complexity':self.max_complex_genome.complexity(),
+									 'max_complexity_key':self.max_complex_genome.key,
+									 'min_complexity':self.min_complex_genome.complexity(),
+									 'avg_complexity':self.avg_complex})
+				# Kept so the evaluated generation can be inspected after reproduction
+				self.evaluated_population = self.population
 
 			# Reporters
-			report_fitness(self)
-			report_species(self.species, self.current_gen)
-			report_output(self)
-			best_fitnesses.append(self.best_genome.fitness)
-			max_complexity.append(self.max_complex_genome.complexity())
-			min_complexity.append(self.min_complex_genome.complexity())
-			avg_complexity.append((avg_complexities+0.0)/len(self.population))
-			self.avg_complex = (avg_complexities+0.0)/len(self.population)
-			avg_complexities = 0
-
-			# Reached fitness goal, we can stop
-			if self.best_genome.fitness >= goal:
-				reached_goal = True
+			if report:
+				with self.phase('report'):
+					self.reporters.post_evaluate(self)
 
 			# Create new unspeciated popuation based on current population's fitness
-			self.population = self.reproduction.reproduce_with_species(self.species,
-																	   self.size,
-																	   self.current_gen)
-			# Check for species extinction (species did not perform well)
-			if not self.species.species:
-				print("!!! Species went extinct !!!")
-				self.population = self.reproduction.create_new_population(self.size)
+			with self.phase('reproduce'):
+				self.population = self.reproduction.reproduce_with_species(self.species,
+																		   self.size,
+																		   self.current_gen)
+				# Check for species extinction (species did not perform well)
+				if not self.species.species:
+					print("!!! Species went extinct !!!")
+					self.population = self.reproduction.create_new_population(self.size)
 
 			# Speciate new population
-			self.species.speciate(self.population, self.current_gen)
-			self.current_gen += 1
+			with self.phase('speciate'):
+				self.species.speciate(self.population, self.current_gen)
+		if report:
+			self.reporters.end_generation(self)
+		profiler.sample_counters(generation=self.current_gen)
+		self.current_gen += 1
 
-		generations = range(self.current_gen)
-		plot_fitness(generations, best_fitnesses)
-		return self.best_genome
+	@contextmanager
+	def phase(self, name, **args):
+		'''
+		Times a phase of the current generation into phase_times and the profiler.
+
+		name -- phase name
+		args -- optional values attached to the profiler's trace event
+		'''
+		start = perf_counter()
+		with profiler.timer(name, **args):
+			yield
+		self.phase_times[name] = perf_counter() - start
+
+	def emigrants(self, num_genomes):
+		'''
+		Returns the fittest genomes of the last evaluated generation.
+
+		num_genomes -- number of genomes to return
+		'''
+		evaluated = list(itervalues(self.evaluated_population))
+		evaluated.sort(reverse=True, key=lambda genome: genome.fitness)
+		return evaluated[:num_genomes]
+
+	def accept_immigrants(self, genomes):
+		'''
+		Adds genomes from another population in place of offspring of the
+		current generation, chosen at random, then speciates the population
+		again. Elites are never replaced. Immigrants are given new keys from this population.
+
+		genomes -- genomes to add
+		'''
+		offspring = [key for key in self.population if key not in self.evaluated_population]
+		replaced = random.sample(offspring, min(len(genomes), len(offspring)))
+		for key, genome in zip(replaced, genomes):
+			del self.population[key]
+			genome.key = self.reproduction.get_new_genome_key()
+			genome.fitness = None
+			self.population[genome.key] = genome
+		self.species.speciate(self.population, self.current_gen)
+
+	def save_checkpoint(self, path):
+		'''
+		Writes the population to a binary checkpoint file. The file is
+		replaced atomically, so a run interrupted while writing keeps its
+		previous checkpoint.
+
+		path -- checkpoint file path
+		'''
+		# Fails before any file is touched if the key cannot be stored
+		key_record = pack_population_key(self.key)
+		temp_path = path + '.tmp'
+		try:
+			with open(temp_path, 'wb') as f:
+				f.write(checkpoint_format.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION,
+											   self.size, self.elitism,
+											   self.current_gen, self.reproduction.next_genome_key,
+											   self.best_genome is not None,
+											   len(self.population)))
+				f.write(key_record)
+				if self.best_genome is not None:
+					write_genome(f, self.best_genome)
+				for genome in itervalues(self.population):
+					write_genome(f, genome)
+			os.replace(temp_path, path)
+		except BaseException:
+			# Leave the previous checkpoint as the only file
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+			raise
+
+	@classmethod
+	def load_checkpoint(cls, path, reporters=None, history=None):
+		'''
+		Returns the population stored in a checkpoint file. The population is
+		speciated again on load, so species history starts over.
+
+		path 	  -- checkpoint file path
+		reporters -- optional list of reporter plugins (see __init__)
+		history   -- optional RunHistory (see __init__)
+		'''
+		with open(path, 'rb') as f:
+			header = f.read(checkpoint_format.size)
+			if len(header) != checkpoint_format.size:
+				raise GenomeCodecError("Truncated checkpoint.")
+			(magic, version, size, elitism, current_gen, next_genome_key,
+			 has_best, num_genomes) = checkpoint_format.unpack(header)
+			if magic != CHECKPOINT_MAGIC:
+				raise GenomeCodecError("Not a population checkpoint.")
+			if version != CHECKPOINT_VERSION:
+				raise GenomeCodecError("Unsupported checkpoint version: {0}".format(version))
+			key = read_population_key(f)
+			best_genome = read_genome(f) if has_best else None
+			population = {}
+			for _ in range(num_genomes):
+				genome = read_genome(f)
+				population[genome.key] = genome
+		reproduction = Reproduction()
+		reproduction.next_genome_key = next_genome_key
+		pop = cls(key, size, elitism, state=(population, reproduction),
+				  reporters=reporters, history=history)
+		pop.current_gen = current_gen
+		pop.best_genome = best_genome
+		return pop
@@ -0,0 +1,162 @@
+'''
+Named timers and counters for profiling evolutionary runs.
+
+The module-level profiler is disabled by default. While disabled, timer()
+returns a shared do-nothing context manager and count() returns at once, so
+instrumented code costs next to nothing. Recorded runs can be exported as a
+Chrome trace (viewable in chrome://tracing or Perfetto) or as JSON lines.
+'''
+import os
+import json
+import threading
+from time import perf_counter
+
+class NullTimer:
+	# Context manager used in place of a Timer while profiling is disabled
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+null_timer = NullTimer()
+
+class Timer:
+	# Context manager timing one occurrence of a named phase
+	def __init__(self, profiler, name, args):
+		self.profiler = profiler
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.profiler.record(self.name, self.start, perf_counter(), self.args)
+		return False
+
+class Profiler:
+
+	def __init__(self, enabled=False):
+		'''
+		Collects timed phases and counters.
+
+		enabled -- whether timers and counters record anything
+		'''
+		self.enabled = enabled
+		self.reset()
+
+	def reset(self):
+		'''
+		Discards everything recorded so far.
+		'''
+		self.origin = perf_counter()
+		self.events = []
+		# Timer names mapped to [number of calls, total seconds]
+		self.timers = {}
+		self.counters = {}
+
+	def enable(self):
+		self.enabled = True
+
+	def disable(self):
+		self.enabled = False
+
+	def timer(self, name, **args):
+		'''
+		Returns a context manager that times the enclosed block.
+
+		name -- phase name
+		args -- optional values attached to the trace event (e.g. generation)
+		'''
+		if not self.enabled:
+			return null_timer
+		return Timer(self, name, args)
+
+	def count(self, name, n=1):
+		'''
+		Adds to a named counter.
+
+		name -- counter name
+		n 	 -- amount to add
+		'''
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def record(self, name, start, end, args=None):
+		'''
+		Records one timed occurrence of a phase.
+
+		name  -- phase name
+		start -- perf_counter() value at the start of the phase
+		end   -- perf_counter() value at the end of the phase
+		args  -- optional values attached to the trace event
+		'''
+		totals = self.timers.setdefault(name, [0, 0.0])
+		totals[0] += 1
+		totals[1] += end - start
+		event = {'name':name, 'ph':'X', 'ts':(start-self.origin)*1e6,
+				 'dur':(end-start)*1e6, 'pid':os.getpid(), 'tid':threading.get_ident()}
+		if args:
+			event['args'] = args
+		self.events.append(event)
+
+	def sample_counters(self, **args):
+		'''
+		Records the current counter values as a trace event, e.g. once per
+		generation.
+
+		args -- optional values stored with the counters (e.g. generation)
+		'''
+		if not self.enabled:
+			return
+		values = dict(self.counters)
+		values.update(args)
+		self.events.append({'name':'counters', 'ph':'C', 'ts':(perf_counter()-self.origin)*1e6,
+							'pid':os.getpid(), 'tid':threading.get_ident(), 'args':values})
+
+	def summary(self):
+		'''
+		Returns the number of calls and total seconds of each timer, along
+		with the counter values.
+		'''
+		return {'timers':{name:{'calls':calls, 'seconds':seconds}
+						  for name, (calls, seconds) in self.timers.items()},
+				'counters':dict(self.counters)}
+
+	def write_chrome_trace(self, path):
+		'''
+		Writes the recorded events in Chrome trace format.
+
+		path -- output file path
+		'''
+		with open(path, 'w') as f:
+			json.dump({'traceEvents':self.events, 'displayTimeUnit':'ms',
+					   'otherData':self.summary()}, f)
+
+	def write_jsonl(self, path):
+		'''
+		Writes the recorded events as JSON lines, one event per line.
+
+		path -- output file path
+		'''
+		with open(path, 'w') as f:
+			for event in self.events:
+				f.write(json.dumps(event))
+				f.write('\n')
+
+	def write_trace(self, path):
+		'''
+		Writes the recorded events as JSON lines if path ends in .jsonl and in
+		Chrome trace format otherwise.
+
+		path -- output file path
+		'''
+		if path.endswith('.jsonl'):
+			self.write_jsonl(path)
+		else:
+			self.write_chrome_trace(path)
+
+# Profiler used by the instrumented modules
+profiler = Profiler()
@@ -1,14 +1,19 @@
 '''
-Set of functions for reporting status of an evolutionary run.
+Set of functions and reporter plugins for reporting status of an
+evolutionary run.
+
+Plotting libraries are only imported when a plot is drawn, so importing the
+core package stays fast in worker processes.
 
 NOTE: Only meant for XOR at the moment. Working on generalizing to any task.
 '''
+import json
+import numpy as np
 from deep_hyperneat.util import iteritems,itervalues,iterkeys
 from deep_hyperneat.phenomes import FeedForwardCPPN as CPPN
 from deep_hyperneat.phenomes import FeedForwardSubstrate as Substrate
 from deep_hyperneat.decode import decode
-import seaborn
-import matplotlib.pyplot as plt
+from deep_hyperneat.cache import phenotype_cache
 
 sub_in_dims = [1,2]
 sub_sh_dims = [1,3]
@@ -23,8 +28,7 @@ def report_output(pop):
 	pop -- population to be reported
 	'''
 	genome = pop.best_genome
-	cppn = CPPN.create(genome)
-	substrate = decode(cppn,sub_in_dims,sub_o_dims,sub_sh_dims)
+	substrate = phenotype_cache.substrate(genome,sub_in_dims,sub_o_dims,sub_sh_dims)
 	sum_square_error = 0.0
 	print("\n=================================================")
 	print("\tChampion Output at Generation: {}".format(pop.current_gen))
@@ -77,10 +81,175 @@ def report_species(species_set, generation):
 			species_set.species[species].fitness,
 			species_set.species[species].max_fitness,
 			len(species_set.species[species].members))
+	stats = species_set.distance_stats
+	print("\nDistance Cache Hits/Misses/Evictions \t Cached Pairs")
+	print("==================================== \t ============")
+	print("{} / {} / {} \t\t\t\t {}".format(stats.get('hits'), stats.get('misses'),
+		  stats.get('evictions'), stats.get('cached_pairs')))
 
 def plot_fitness(x,y):
+	# Imported here, as importing the plotting libraries takes about a second
+	import seaborn
+	import matplotlib.pyplot as plt
 	plt.plot(x,y)
 	plt.ylabel("Fitness")
 	plt.xlabel("Generation")
 	plt.tight_layout()
 	plt.savefig("reports/fitness_plot.png")
+
+class BaseReporter:
+	# Reporter plugin. Subclasses override the hooks they need.
+	def post_evaluate(self, pop):
+		'''
+		Called each generation once the population has been evaluated and the
+		best and complexity statistics are updated.
+
+		pop -- population being evolved
+		'''
+		pass
+
+	def end_generation(self, pop):
+		'''
+		Called at the end of each generation, after the next generation has
+		been reproduced and speciated and pop.phase_times holds the time
+		spent in each phase.
+
+		pop -- population being evolved
+		'''
+		pass
+
+	def end_run(self, pop):
+		'''
+		Called when Population.run finishes.
+
+		pop -- population being evolved
+		'''
+		pass
+
+class ReporterSet:
+	# Reporters of a population, called in the order they were added
+	def __init__(self, reporters=()):
+		self.reporters = list(reporters)
+
+	def add(self, reporter):
+		self.reporters.append(reporter)
+
+	def remove(self, reporter):
+		self.reporters.remove(reporter)
+
+	def post_evaluate(self, pop):
+		for reporter in self.reporters:
+			reporter.post_evaluate(pop)
+
+	def end_generation(self, pop):
+		for reporter in self.reporters:
+			reporter.end_generation(pop)
+
+	def end_run(self, pop):
+		for reporter in self.reporters:
+			reporter.end_run(pop)
+
+class StdOutReporter(BaseReporter):
+	# Prints fitness and species statistics each generation
+	def post_evaluate(self, pop):
+		report_fitness(pop)
+		report_species(pop.species, pop.current_gen)
+
+class ChampionOutputReporter(BaseReporter):
+	# Prints the output of the champion on the XOR task whenever it changes
+	def __init__(self):
+		self.champion = None
+
+	def post_evaluate(self, pop):
+		if pop.best_genome is not self.champion:
+			self.champion = pop.best_genome
+			report_output(pop)
+
+class FitnessPlotReporter(BaseReporter):
+	# Plots the best fitness of each generation of a run when it finishes,
+	#	reading them from the population's history
+	def __init__(self):
+		self.start_gen = None
+
+	def post_evaluate(self, pop):
+		if self.start_gen is None:
+			self.start_gen = pop.current_gen
+
+	def end_run(self, pop):
+		entries = [entry for entry in pop.history if entry['generation'] >= self.start_gen]
+		plot_fitness([entry['generation'] for entry in entries],
+					 [entry['best_fitness'] for entry in entries])
+		self.start_gen = None
+
+class MetricsReporter(BaseReporter):
+	# Writes one compact JSON record per generation to a buffered file
+	def __init__(self, path, champion_evaluator=None, buffer_size=1<<16, append=False):
+		'''
+		Each record holds the generation's fitness statistics, species sizes,
+		complexity statistics, champion, distance cache statistics and phase
+		timings.
+
+		path 			   -- file the JSON lines are written to
+		champion_evaluator -- optional function taking the champion genome and
+							  returning a JSON-serializable value (e.g. its outputs).
+							  It is only called when the champion changes.
+		buffer_size 	   -- size in bytes of the write buffer
+		append 			   -- if True, add to an existing file (e.g. when resuming
+							  from a checkpoint) instead of replacing it
+		'''
+		self.path = path
+		self.champion_evaluator = champion_evaluator
+		self.buffer_size = buffer_size
+		self.append = append
+		self.file = None
+		self.champion = None
+		self.record = None
+
+	def post_evaluate(self, pop):
+		if self.file is None:
+			# Later runs of the population add to the records of earlier ones
+			self.file = open(self.path, 'a' if self.append else 'w', buffering=self.buffer_size)
+			self.append = True
+		fitnesses = np.array([genome.fitness for genome in itervalues(pop.population)], dtype=float)
+		complexities = np.array([genome.complexity() for genome in itervalues(pop.population)])
+		champion = {'key':pop.best_genome.key, 'fitness':float(pop.best_genome.fitness),
+					'complexity':pop.best_genome.complexity()}
+		if pop.best_genome is not self.champion:
+			self.champion = pop.best_genome
+			champion['changed'] = True
+			if self.champion_evaluator is not None:
+				champion['evaluation'] = self.champion_evaluator(pop.best_genome)
+		self.record = {
+			'generation':pop.current_gen,
+			'fitness':{'max':float(fitnesses.max()), 'mean':float(fitnesses.mean()),
+					   'min':float(fitnesses.min()), 'std':float(fitnesses.std())},
+			'species':{str(sid):len(species.members) for sid, species in iteritems(pop.species.species)},
+			'complexity':{'max':int(complexities.max()), 'mean':float(complexities.mean()),
+						  'min':int(complexities.min())},
+			'champion':champion}
+
+	def end_generation(self, pop):
+		if self.record is None:
+			return
+		self.record['distance_cache'] = dict(pop.species.distance_stats)
+		self.record['phase_times'] = pop.phase_times
+		self.file.write(json.dumps(self.record, separators=(',', ':')))
+		self.file.write('\n')
+		self.record = None
+
+	def end_run(self, pop):
+		self.close()
+
+	def close(self):
+		'''
+		Flushes and closes the metrics file.
+		'''
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+def default_reporters():
+	'''
+	Returns the reporters a population uses unless given others.
+	'''
+	return [StdOutReporter(), ChampionOutputReporter(), FitnessPlotReporter()]
@@ -5,15 +5,15 @@ Largely copied from neat-python. (Copyright 2015-2017, CodeReclaimers, LLC.)
 '''
 import random
 from math import ceil
-from deep_hyperneat.genome import Genome
+from deep_hyperneat.genome import Genome, batch_mutate_weights
 from deep_hyperneat.stagnation import Stagnation
-from itertools import count
 from deep_hyperneat.util import itervalues, iteritems, mean
 
 class Reproduction:
 
 	def __init__(self):
-		self.genome_indexer = count(1)
+		# Key given to the next new genome
+		self.next_genome_key = 1
 		self.reporters = None
 		# Number of elites allowed to be cloned into species each gen
 		self.species_elitism = 1
@@ -21,6 +21,14 @@ class Reproduction:
 		# Fraction of members of a species allowed to reproduce each gen
 		self.species_reproduction_threshold = 0.2
 
+	def get_new_genome_key(self):
+		'''
+		Returns new genome key
+		'''
+		new_id = self.next_genome_key
+		self.next_genome_key += 1
+		return new_id
+
 	def create_new_population(self, num_genomes):
 		'''
 		Creates a fresh population
@@ -30,7 +38,7 @@ class Reproduction:
 		new_genomes = {}
 		# Create n new, minimal genomes
 		for i in range(num_genomes):
-			gid = next(self.genome_indexer)
+			gid = self.get_new_genome_key()
 			# Create genome
 			new_genome = Genome(gid)
 			new_genomes[gid] = new_genome
@@ -131,6 +139,8 @@ class Reproduction:
 		spawn_amounts = self.compute_species_sizes(adjusted_fitnesses, previous_sizes,
 												   pop_size, min_species_size)
 		new_population = {}
+		# Offspring whose weights are mutated together once all are created
+		offspring = []
 		species_set.species = {}
 		for spawn, species in zip(spawn_amounts, remaining_species):
 			# If elitism is enabled, each species always at least gets to retain its elites.
@@ -164,10 +174,11 @@ class Reproduction:
 				spawn -= 1
 				parent1_key, parent1 = random.choice(old_species_members)
 				# parent2_key, parent2 = random.choice(old_species_members)
-				child_key = next(self.genome_indexer)
-				child = Genome(child_key)
+				child_key = self.get_new_genome_key()
 				# child.crossover(parent1, parent2)
-				child.copy(parent1,generation)
-				child.mutate(generation)
+				child = parent1.clone(child_key, generation)
+				child.mutate(generation, mutate_weights=False)
 				new_population[child_key] = child
+				offspring.append(child)
+		batch_mutate_weights(offspring)
 		return new_population
@@ -3,17 +3,31 @@ Classes that handle speciation in Deep HyperNEAT.
 
 Largely copied from neat-python. Copyright 2015-2017, CodeReclaimers, LLC.
 '''
+import numpy as np
 from itertools import count
+from collections import OrderedDict
 from deep_hyperneat.util import iteritems, iterkeys, itervalues
+from deep_hyperneat.profiling import profiler
 
 class GenomeDistanceCache:
 	# Cache of genome distances
-	def __init__(self):
-		self.distances = {}
+	def __init__(self, max_distances=None):
+		'''
+		max_distances -- optional maximum number of cached genome pairs; the
+						 least recently used pairs are evicted beyond it
+		'''
+		# Ordered from least to most recently used
+		self.distances = OrderedDict()
+		# Genome keys mapped to the keys of genomes they have cached distances with
+		self.partners = {}
+		self.max_distances = max_distances
 		self.hits = 0
 		self.misses = 0
+		self.evictions = 0
 		self.compatibility_disjoint_coefficient = 1.0
 		self.compatibility_weight_coefficient = 0.5
+		self.engine = GenomeDistanceEngine(self.compatibility_disjoint_coefficient,
+										   self.compatibility_weight_coefficient)
 
 	def __call__(self, genome0, genome1):
 		genome_key_0 = genome0.key
@@ -22,13 +36,89 @@ class GenomeDistanceCache:
 		if distance is None:
 			# Distance is not already computed.
 			distance = self.genome_distance(genome0,genome1)
-			self.distances[genome_key_0, genome_key_1] = distance
-			self.distances[genome_key_1, genome_key_0] = distance
+			self.store(genome_key_0, genome_key_1, distance)
 			self.misses += 1
+			profiler.count('distance_computations')
 		else:
+			if self.max_distances is not None:
+				self.touch(genome_key_0, genome_key_1)
 			self.hits += 1
 		return distance
 
+	def distances_to(self, genome, others):
+		'''
+		Returns the list of distances between a genome and each of a list of
+		other genomes. Distances not already cached are computed together in
+		one vectorized pass.
+
+		genome -- genome to measure distances from
+		others -- list of genomes to measure distances to
+		'''
+		genome_key = genome.key
+		distances = [self.distances.get((genome_key, other.key)) for other in others]
+		missing = [idx for idx, distance in enumerate(distances) if distance is None]
+		self.hits += len(others) - len(missing)
+		if self.max_distances is not None and len(missing) < len(others):
+			for other, distance in zip(others, distances):
+				if distance is not None:
+					self.touch(genome_key, other.key)
+		if missing:
+			computed = self.engine.distances(genome, [others[idx] for idx in missing])
+			for idx, distance in zip(missing, computed.tolist()):
+				self.store(genome_key, others[idx].key, distance)
+				distances[idx] = distance
+			self.misses += len(missing)
+			profiler.count('distance_computations', len(missing))
+		return distances
+
+	def store(self, genome_key_0, genome_key_1, distance):
+		self.distances[genome_key_0, genome_key_1] = distance
+		self.distances[genome_key_1, genome_key_0] = distance
+		self.partners.setdefault(genome_key_0, set()).add(genome_key_1)
+		self.partners.setdefault(genome_key_1, set()).add(genome_key_0)
+		# Evict the least recently used pairs when over the memory cap
+		if self.max_distances is not None:
+			while len(self.distances) > 2*self.max_distances:
+				self.evict_pair(*next(iter(self.distances)))
+
+	def touch(self, genome_key_0, genome_key_1):
+		# Marks a cached pair as most recently used
+		self.distances.move_to_end((genome_key_0, genome_key_1))
+		self.distances.move_to_end((genome_key_1, genome_key_0))
+
+	def evict_pair(self, genome_key_0, genome_key_1):
+		self.distances.pop((genome_key_0, genome_key_1), None)
+		self.distances.pop((genome_key_1, genome_key_0), None)
+		for key, partner in ((genome_key_0, genome_key_1), (genome_key_1, genome_key_0)):
+			partners = self.partners.get(key)
+			if partners is not None:
+				partners.discard(partner)
+				if not partners:
+					del self.partners[key]
+		self.evictions += 1
+
+	def retain(self, genome_keys):
+		'''
+		Evicts the distances and encodings of every genome not in genome_keys,
+		i.e. genomes that have left the population.
+
+		genome_keys -- keys of the genomes still in the population
+		'''
+		for key in [key for key in self.partners if key not in genome_keys]:
+			for partner in list(self.partners.get(key, ())):
+				self.evict_pair(key, partner)
+		self.engine.retain(genome_keys)
+
+	def reset_stats(self):
+		'''
+		Returns the hit, miss and eviction counts since the last reset, along
+		with the number of cached pairs, and resets the counts.
+		'''
+		stats = {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions,
+				 'cached_pairs':len(self.distances)//2}
+		self.hits = self.misses = self.evictions = 0
+		return stats
+
 	def genome_distance(self, genome0, genome1):
 		'''
 		Computes genome distance between two genomes
@@ -99,6 +189,113 @@ class GenomeDistanceCache:
 		d = abs(conn_gene_0.weight - conn_gene_1.weight)
 		return d * self.compatibility_weight_coefficient
 
+class GenomeEncoding:
+	# Genes of a genome as sorted key arrays plus attribute arrays
+	def __init__(self, genome):
+		'''
+		genome -- genome to encode
+		'''
+		nodes = sorted(iteritems(genome.nodes))
+		self.node_keys = np.array([key for key, _ in nodes], dtype=np.int64)
+		self.biases = np.array([node.bias for _, node in nodes], dtype=float)
+		self.activations = np.array([node.activation_id for _, node in nodes], dtype=np.int64)
+		# Connection keys (source, target) packed into a single sortable integer
+		connections = sorted(iteritems(genome.connections))
+		self.connection_keys = np.array([source*2**32 + target for (source, target), _ in connections],
+										dtype=np.int64)
+		self.weights = np.array([conn.weight for _, conn in connections], dtype=float)
+
+class GenomeDistanceEngine:
+	# Vectorized computation of genome distances
+	def __init__(self, disjoint_coefficient=1.0, weight_coefficient=0.5):
+		'''
+		Computes the same distances as GenomeDistanceCache.genome_distance, but
+		between one genome and many others at once.
+
+		disjoint_coefficient -- weight of disjoint genes in the distance
+		weight_coefficient   -- weight of homologous gene differences in the distance
+		'''
+		self.disjoint_coefficient = disjoint_coefficient
+		self.weight_coefficient = weight_coefficient
+		self.encodings = {}
+
+	def encode(self, genome):
+		'''
+		Returns the (cached) encoding of a genome.
+		'''
+		encoding = self.encodings.get(genome.key)
+		if encoding is None:
+			encoding = GenomeEncoding(genome)
+			self.encodings[genome.key] = encoding
+		return encoding
+
+	def retain(self, genome_keys):
+		'''
+		Drops the encodings of every genome not in genome_keys.
+		'''
+		for key in [key for key in self.encodings if key not in genome_keys]:
+			del self.encodings[key]
+
+	def distances(self, genome, others):
+		'''
+		Returns an array of the distances between a genome and each of a list
+		of other genomes.
+
+		genome -- genome to measure distances from
+		others -- list of genomes to measure distances to
+		'''
+		if not others:
+			return np.zeros(0)
+		encoding = self.encode(genome)
+		encodings = [self.encode(other) for other in others]
+		# Homologous node genes differ by bias and activation function
+		biases = np.concatenate([e.biases for e in encodings])
+		activations = np.concatenate([e.activations for e in encodings])
+		node_distances = self.gene_distances(encoding.node_keys, [e.node_keys for e in encodings],
+			lambda own, other: (np.abs(encoding.biases[own] - biases[other]) +
+								(encoding.activations[own] != activations[other])))
+		# Homologous connection genes differ by weight
+		weights = np.concatenate([e.weights for e in encodings])
+		connection_distances = self.gene_distances(encoding.connection_keys,
+			[e.connection_keys for e in encodings],
+			lambda own, other: np.abs(encoding.weights[own] - weights[other]))
+		return node_distances + connection_distances
+
+	def gene_distances(self, keys, other_keys, homologous_difference):
+		'''
+		Computes the node or connection part of the distances.
+
+		keys 		  -- sorted gene keys of the genome
+		other_keys 	  -- list of gene key arrays of the other genomes
+		homologous_difference -- function taking the indices of matching genes in
+								 keys and in the concatenated other keys, and
+								 returning their attribute differences
+		'''
+		num_genes = len(keys)
+		num_other_genes = np.array([len(k) for k in other_keys])
+		num_others = len(other_keys)
+		all_keys = np.concatenate(other_keys)
+		owners = np.repeat(np.arange(num_others), num_other_genes)
+		# Find which genes of the other genomes are homologous to the genome's
+		if num_genes:
+			idx = np.minimum(np.searchsorted(keys, all_keys), num_genes-1)
+			matched = keys[idx] == all_keys
+		else:
+			idx = np.zeros(len(all_keys), dtype=int)
+			matched = np.zeros(len(all_keys), dtype=bool)
+		other_idx = np.flatnonzero(matched)
+		differences = np.zeros(len(all_keys))
+		differences[other_idx] = homologous_difference(idx[other_idx], other_idx) * self.weight_coefficient
+		homologous = np.bincount(owners, weights=matched, minlength=num_others)
+		difference_sums = np.bincount(owners, weights=differences, minlength=num_others)
+		disjoint = (num_other_genes - homologous) + (num_genes - homologous)
+		max_genes = np.maximum(num_other_genes, num_genes)
+		distances = np.zeros(num_others)
+		has_genes = max_genes > 0
+		distances[has_genes] = ((difference_sums[has_genes] + self.disjoint_coefficient*disjoint[has_genes]) /
+								max_genes[has_genes])
+		return distances
+
 class Species:
 	# Class for individual species
 	def __init__(self, key, generation):
@@ -121,10 +318,18 @@ class Species:
 
 class SpeciesSet:
 	# Class for handling sets of species within a population
-	def __init__(self, threshold):
+	def __init__(self, threshold, max_distances=100000):
+		'''
+		threshold     -- compatibility threshold
+		max_distances -- maximum number of genome pairs in the distance cache
+		'''
 		self.threshold = threshold
 		self.species = {}
 		self.species_indexer = count(1)
+		# Distances persist across generations for surviving genomes
+		self.distances = GenomeDistanceCache(max_distances)
+		# Distance cache statistics of the last speciation
+		self.distance_stats = {}
 		self.genome_to_species = {}
 
 	def speciate(self,population,generation):
@@ -136,28 +341,31 @@ class SpeciesSet:
 		# Set of unspeciated members of the population
 		unspeciated = set(iterkeys(population))
 		# Means of determining distances
-		distances = GenomeDistanceCache()
-		# New representatives and members of species
+		distances = self.distances
+		# New representatives and members of species, updated incrementally
 		new_representatives = {}
 		new_members = {}
+		genome_to_species = {}
 		# Traverse through set of species from last generation
 		for sid, species in iteritems(self.species):
-			# Candidates for current species representatives
-			candidate_representatives = []
 			# Traverese genomes in the unspeciated and check their distance
 			# from the current species representative
-			for gid in unspeciated:
-				genome = population[gid]
-				genome_distance = distances(species.representative, genome)
-				candidate_representatives.append((genome_distance, genome))
+			candidates = [population[gid] for gid in unspeciated]
+			candidate_distances = distances.distances_to(species.representative, candidates)
+			# Candidates for current species representatives
+			candidate_representatives = list(zip(candidate_distances, candidates))
 			# The new representative for the current species is the
 			# closest to the current representative
 			_, new_rep = min(candidate_representatives, key=lambda x: x[0])
 			new_rid = new_rep.key
-			new_representatives[sid] = new_rid
-			new_members[sid] = [new_rid]
+			new_representatives[sid] = new_rep
+			new_members[sid] = {new_rid:new_rep}
+			genome_to_species[new_rid] = sid
 			unspeciated.remove(new_rid)
 
+		# Species ids and their representatives, in the order they were created
+		species_ids = list(new_representatives)
+		representatives = list(itervalues(new_representatives))
 		# Partition the population in species based on genetic similarity
 		while unspeciated:
 			gid = unspeciated.pop()
@@ -165,39 +373,40 @@ class SpeciesSet:
 			# Find the species with the most similar representative to the
 			# 	current genome from the unspeciated set
 			candidate_species = []
+			# Determine current genome's distance from all species representatives
+			representative_distances = distances.distances_to(genome, representatives)
 			# Traverse species and their representatives
-			for sid, rid in iteritems(new_representatives):
-				representative = population[rid]
-				# Determine current genome's distance from representative
-				genome_distance = distances(representative, genome)
+			for sid, genome_distance in zip(species_ids, representative_distances):
 				# If it's below threshold, add it to list for adding to the species
 				if genome_distance < compatibility_threshold:
 					candidate_species.append((genome_distance, sid))
 			# Add current genome to the species its most genetically similar to
 			if candidate_species:
 				_, sid = min(candidate_species, key=lambda x: x[0])
-				new_members[sid].append(gid)
+				new_members[sid][gid] = genome
 			else:
 				# No species is similar enough so we create a mnew species with
 				# 	the current genome as its representative
 				sid = next(self.species_indexer)
-				new_representatives[sid] = gid
-				new_members[sid] = [gid]
-			# Update species collection based on new speciation
-			self.genome_to_species = {}
-			for sid, rid in iteritems(new_representatives):
-				# Add species if not existing in current species set
-				s = self.species.get(sid)
-				if s is None:
-					s = Species(sid, generation)
-					self.species[sid] = s
-				# Collect and add members to current species
-				members = new_members[sid]
-				for gid in members:
-					self.genome_to_species[gid] = sid
-				# Update current species members and represenative
-				member_dict = {gid:population[gid] for gid in members}
-				s.update(population[rid], member_dict)
+				new_representatives[sid] = genome
+				new_members[sid] = {gid:genome}
+				species_ids.append(sid)
+				representatives.append(genome)
+			genome_to_species[gid] = sid
+
+		# Update species collection based on new speciation
+		for sid, representative in iteritems(new_representatives):
+			# Add species if not existing in current species set
+			s = self.species.get(sid)
+			if s is None:
+				s = Species(sid, generation)
+				self.species[sid] = s
+			# Update current species members and represenative
+			s.update(representative, new_members[sid])
+		self.genome_to_species = genome_to_species
+		# Forget distances of genomes that have left the population
+		distances.retain(population)
+		self.distance_stats = distances.reset_stats()
 
 	def get_species_key(self, key):
 		return self.genome_to_species[key]
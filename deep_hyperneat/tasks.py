@@ -0,0 +1,102 @@
+'''
+Tasks that can be passed to Population.run.
+
+A task is called with a list of (genome key, genome) pairs and assigns each
+genome's fitness.
+'''
+import numpy as np
+from deep_hyperneat.phenomes import FeedForwardCPPN
+from deep_hyperneat.decode import decode
+from deep_hyperneat.cache import phenotype_cache
+
+def mean_squared_error(outputs, targets):
+	return float(np.mean((outputs - targets)**2))
+
+def mean_absolute_error(outputs, targets):
+	return float(np.mean(np.abs(outputs - targets)))
+
+def one_minus_loss(loss):
+	return 1.0 - loss
+
+class SupervisedTask:
+
+	def __init__(self, inputs, targets, input_dimensions, output_dimensions,
+				 sheet_dimensions=None, loss=mean_squared_error, fitness=one_minus_loss,
+				 bias=1.0, cache=True):
+		'''
+		Task fitting a substrate to a dataset of input and target rows. Each
+		genome is decoded once and all cases are run through its substrate
+		as one batch.
+
+		inputs 			  -- array of shape (number of cases, number of substrate inputs)
+		targets 		  -- array of shape (number of cases, number of substrate outputs)
+		input_dimensions  -- dimensions of substrate input layer
+		output_dimensions -- dimensions of substrate output layer
+		sheet_dimensions  -- optional substrate sheet dimensions
+		loss 			  -- function taking the output and target arrays and returning a loss
+		fitness 		  -- function mapping a loss to a fitness (defaults to 1 - loss)
+		bias 			  -- value of the substrate's bias input
+		cache 			  -- if True, decode through the shared phenotype cache so
+							 unchanged elites are not decoded again. A PhenotypeCache
+							 can be given instead, e.g. to keep the phenomes of
+							 populations evolving in the same process apart.
+		'''
+		inputs = np.asarray(inputs, dtype=float)
+		if inputs.ndim == 1:
+			inputs = inputs.reshape(-1, 1)
+		targets = np.asarray(targets, dtype=float)
+		if targets.ndim == 1:
+			targets = targets.reshape(-1, 1)
+		if len(inputs) != len(targets):
+			raise ValueError("Got {0:n} input rows but {1:n} target rows.".format(
+							 len(inputs), len(targets)))
+		# Inputs with the bias value appended, as substrates expect
+		self.inputs = np.hstack([inputs, np.full((len(inputs), 1), bias)])
+		self.targets = targets
+		self.input_dimensions = input_dimensions
+		self.output_dimensions = output_dimensions
+		self.sheet_dimensions = sheet_dimensions
+		self.loss = loss
+		self.fitness = fitness
+		# Cache of decoded substrates, which Population.step() evicts the
+		#	genomes that have left the population from
+		self.phenotype_cache = phenotype_cache if cache is True else (cache or None)
+
+	def __call__(self, genomes):
+		'''
+		Assigns the fitness of each genome.
+
+		genomes -- list of (genome key, genome) pairs
+		'''
+		for genome_key, genome in genomes:
+			genome.fitness = self.evaluate(genome)
+
+	def substrate(self, genome):
+		'''
+		Returns the substrate a genome decodes into.
+
+		genome -- genome to decode
+		'''
+		if self.phenotype_cache is not None:
+			return self.phenotype_cache.substrate(genome, self.input_dimensions,
+												  self.output_dimensions, self.sheet_dimensions)
+		return decode(FeedForwardCPPN.create(genome), self.input_dimensions,
+					  self.output_dimensions, self.sheet_dimensions)
+
+	def outputs(self, genome):
+		'''
+		Returns the substrate outputs of a genome for every case, as an array
+		of shape (number of cases, number of outputs).
+
+		genome -- genome to evaluate
+		'''
+		return self.substrate(genome).activate_batch(self.inputs)
+
+	def evaluate(self, genome):
+		'''
+		Returns the fitness of a genome. Can be used on its own as the
+		evaluation function of a ParallelEvaluator.
+
+		genome -- genome to evaluate
+		'''
+		return self.fitness(self.loss(self.outputs(genome), self.targets))
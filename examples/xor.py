@@ -3,6 +3,7 @@ from deep_hyperneat.population import Population
 from deep_hyperneat.phenomes import FeedForwardCPPN as CPPN
 from deep_hyperneat.decode import decode
 from deep_hyperneat.visualize import draw_net
+from deep_hyperneat.tasks import SupervisedTask
 
 # Substrate parameters
 sub_in_dims = [1,2]
@@ -16,21 +17,11 @@ pop_size = 150
 pop_elitism = 2
 num_generations = 500
 
-# Define task
-def xor(genomes):
-	# Task parameters
-	xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
-	expected_outputs = [0.0, 1.0, 1.0, 0.0]
-	# Iterate through potential solutions
-	for genome_key, genome in genomes:
-		cppn = CPPN.create(genome)
-		substrate = decode(cppn,sub_in_dims,sub_o_dims,sub_sh_dims)
-		sum_square_error = 0.0
-		for inputs, expected in zip(xor_inputs, expected_outputs):
-			inputs = inputs + (1.0,)
-			actual_output = substrate.activate(inputs)[0]
-			sum_square_error += ((actual_output - expected)**2.0)/4.0
-		genome.fitness = 1.0 - sum_square_error
+# Define task. Fitness is 1 - mean squared error over the four cases, which
+#	are run through each genome's substrate as one batch.
+xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
+expected_outputs = [0.0, 1.0, 1.0, 0.0]
+xor = SupervisedTask(xor_inputs,expected_outputs,sub_in_dims,sub_o_dims,sub_sh_dims)
 
 # Inititalize population
 pop = Population(pop_key,pop_size,pop_elitism)
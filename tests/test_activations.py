@@ -0,0 +1,49 @@
+'''
+Checks the activation function registry and its vectorized versions.
+'''
+import numpy as np
+import pytest
+from deep_hyperneat.activations import (ActivationFunctionSet, InvalidActivationFunction,
+										relu_activation, np_relu_activation, vectorized)
+
+def square_activation(x):
+	return x*x
+
+def np_square_activation(x):
+	return np.asarray(x, dtype=float)**2
+
+def test_vectorized_versions_agree_with_scalar_versions():
+	activations = ActivationFunctionSet()
+	points = np.linspace(-3.0, 3.0, 25)
+	for name, function in activations.functions.items():
+		expected = [function(float(x)) for x in points]
+		assert np.allclose(activations.get_vectorized(name)(points), expected)
+
+def test_vectorized_versions_are_kept_per_set():
+	activations, others = ActivationFunctionSet(), ActivationFunctionSet()
+	activations.add('square', square_activation, np_square_activation)
+	assert activations.vectorized(square_activation) is np_square_activation
+	assert others.vectorized(square_activation) is not np_square_activation
+	assert vectorized(square_activation) is not np_square_activation
+
+	def np_relu(x):
+		return np.maximum(np.asarray(x, dtype=float), 0.0)
+	activations.add('relu', relu_activation, np_relu)
+	assert activations.vectorized(relu_activation) is np_relu
+	assert others.vectorized(relu_activation) is np_relu_activation
+	assert activations.get_id('relu') == others.get_id('relu')
+
+def test_registered_names_cannot_change_function():
+	activations = ActivationFunctionSet()
+	activations.add('square', square_activation, np_square_activation)
+	function_id = activations.get_id('square')
+	with pytest.raises(InvalidActivationFunction):
+		activations.add('square', lambda x: x**2)
+	assert activations.get('square') is square_activation
+	assert activations.id_of(square_activation) == function_id
+	assert activations.get_by_id(function_id) is square_activation
+
+def test_disagreeing_vectorized_version_is_rejected():
+	activations = ActivationFunctionSet()
+	with pytest.raises(InvalidActivationFunction):
+		activations.add('square', square_activation, np.abs)
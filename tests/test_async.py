@@ -0,0 +1,78 @@
+'''
+Checks the asyncio evaluator against a fake simulator.
+'''
+import asyncio
+import random
+import numpy as np
+from deep_hyperneat.asynchronous import AsyncEvaluator
+from deep_hyperneat.population import Population
+
+class FakeGenome:
+	def __init__(self, key):
+		self.key = key
+		self.fitness = None
+
+class FakeSimulator:
+	# Answers after a delay, counting the evaluations in flight
+	def __init__(self, delay=0.01, slow_keys=(), failing_keys=()):
+		self.delay = delay
+		self.slow_keys = set(slow_keys)
+		self.failing_keys = set(failing_keys)
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self.loops = set()
+
+	async def evaluate(self, genome):
+		self.loops.add(asyncio.get_running_loop())
+		self.in_flight += 1
+		self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		try:
+			await asyncio.sleep(10.0 if genome.key in self.slow_keys else self.delay)
+			if genome.key in self.failing_keys:
+				raise ConnectionError("simulator dropped genome {0}".format(genome.key))
+			return float(genome.key)
+		finally:
+			self.in_flight -= 1
+
+def evaluate(evaluator, keys):
+	genomes = [(key, FakeGenome(key)) for key in keys]
+	evaluator(genomes)
+	return {key:genome.fitness for key, genome in genomes}
+
+def test_concurrency_is_bounded():
+	simulator = FakeSimulator()
+	fitnesses = evaluate(AsyncEvaluator(simulator.evaluate, max_concurrency=3), range(10))
+	assert fitnesses == {key:float(key) for key in range(10)}
+	assert simulator.max_in_flight == 3
+
+def test_timeouts_and_errors_get_their_fitness():
+	simulator = FakeSimulator(slow_keys=[1, 4], failing_keys=[2])
+	evaluator = AsyncEvaluator(simulator.evaluate, timeout=0.2, timeout_fitness=-1.0,
+							   error_fitness=-2.0)
+	fitnesses = evaluate(evaluator, range(6))
+	assert fitnesses == {0:0.0, 1:-1.0, 2:-2.0, 3:3.0, 4:-1.0, 5:5.0}
+	assert (evaluator.timeouts, evaluator.errors) == (2, 1)
+	assert isinstance(evaluator.last_error, ConnectionError)
+
+def test_given_loop_is_reused_across_generations():
+	simulator = FakeSimulator()
+	loop = asyncio.new_event_loop()
+	try:
+		evaluator = AsyncEvaluator(simulator.evaluate, loop=loop)
+		for _ in range(2):
+			evaluate(evaluator, range(4))
+	finally:
+		loop.close()
+	assert simulator.loops == {loop}
+
+def test_run_wraps_coroutine_functions():
+	random.seed(13)
+	np.random.seed(13)
+	async def complexity(genome):
+		await asyncio.sleep(0)
+		return float(genome.complexity())
+	population = Population(1, 10, 1, reporters=[])
+	best_genome = population.run(complexity, 1000.0, 2)
+	assert best_genome.fitness == float(best_genome.complexity())
+	assert all(genome.fitness == float(genome.complexity())
+			   for genome in population.evaluated_population.values())
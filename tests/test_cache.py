@@ -0,0 +1,52 @@
+'''
+Checks the phenotype cache keys and its per-generation eviction.
+'''
+import random
+import numpy as np
+from deep_hyperneat.genome import Genome
+from deep_hyperneat.codec import encode_genome, decode_genome
+from deep_hyperneat.cache import PhenotypeCache, genome_fingerprint
+from deep_hyperneat.population import Population
+from deep_hyperneat.tasks import SupervisedTask
+
+xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
+xor_outputs = [0.0,1.0,1.0,0.0]
+
+def mutated_genome(key, num_mutations=20):
+	genome = Genome(key).clone(key)
+	for _ in range(num_mutations):
+		genome.mutate()
+	return genome
+
+def test_fingerprint_survives_codec_round_trip():
+	random.seed(2)
+	np.random.seed(2)
+	genome = mutated_genome(1)
+	assert genome_fingerprint(decode_genome(encode_genome(genome))) == genome_fingerprint(genome)
+
+def test_fingerprint_normalizes_value_types():
+	random.seed(3)
+	np.random.seed(3)
+	genome = mutated_genome(1)
+	copy = genome.clone(1)
+	node_key = next(iter(copy.nodes))
+	copy.writable_node(node_key).bias = 0
+	genome.writable_node(node_key).bias = 0.0
+	assert genome_fingerprint(copy) == genome_fingerprint(genome)
+
+def test_populations_keep_separate_caches():
+	random.seed(4)
+	np.random.seed(4)
+	tasks = [SupervisedTask(xor_inputs, xor_outputs, [1,2], 1, [1,3], cache=PhenotypeCache())
+			 for _ in range(2)]
+	populations = [Population(i, 20, 1, reporters=[]) for i in range(2)]
+	populations[0].step(tasks[0], report=False)
+	cached = dict(tasks[0].phenotype_cache.entries)
+	populations[1].step(tasks[1], report=False)
+	# Stepping one population leaves the other's cache alone
+	assert tasks[0].phenotype_cache.entries == cached
+	# The next step of a population evicts its culled genomes
+	populations[0].step(tasks[0], report=False)
+	fingerprints = {genome_fingerprint(genome) for genome in populations[0].evaluated_population.values()}
+	assert {key[1] for key in tasks[0].phenotype_cache.entries} <= fingerprints | {
+		genome_fingerprint(populations[0].best_genome)}
@@ -0,0 +1,82 @@
+'''
+Checks that genomes and populations survive the binary codec and checkpoints.
+'''
+import io
+import os
+import random
+import numpy as np
+import pytest
+from deep_hyperneat.genome import Genome
+from deep_hyperneat.codec import write_genome, read_genome, GenomeCodecError
+from deep_hyperneat.population import Population
+from deep_hyperneat.util import iteritems, itervalues
+
+def mutated_genome(key, num_mutations=20):
+	genome = Genome(key).clone(key)
+	for _ in range(num_mutations):
+		genome.mutate()
+	return genome
+
+def genome_state(genome):
+	'''
+	Returns the genes, keys and layout of a genome as plain values.
+	'''
+	nodes = sorted((key, node.type, node.activation_id, node.bias, node.response, node.cppn_tuple)
+				   for key, node in iteritems(genome.nodes))
+	connections = sorted((key, conn.weight, conn.enabled) for key, conn in iteritems(genome.connections))
+	return (genome.key, genome.fitness, genome.next_node_key, list(genome.input_keys),
+			list(genome.output_keys), list(genome.bias_keys), genome.cppn_tuples,
+			genome.substrate, nodes, connections)
+
+def random_fitness(genomes):
+	for _, genome in genomes:
+		genome.fitness = random.random()
+
+def test_genome_round_trip():
+	random.seed(6)
+	np.random.seed(6)
+	genomes = [mutated_genome(key) for key in range(1, 6)]
+	genomes[0].fitness = 0.25
+	stream = io.BytesIO()
+	for genome in genomes:
+		write_genome(stream, genome)
+	stream.seek(0)
+	for genome in genomes:
+		decoded = read_genome(stream)
+		assert genome_state(decoded) == genome_state(genome)
+		assert all(type(x) is int for node in itervalues(decoded.nodes) if node.cppn_tuple
+				   for x in sum(node.cppn_tuple, ()))
+	with pytest.raises(GenomeCodecError):
+		read_genome(stream)
+
+@pytest.mark.parametrize('key', [3, 'xor'])
+def test_checkpoint_round_trip(tmp_path, key):
+	random.seed(7)
+	np.random.seed(7)
+	population = Population(key, 10, 1, reporters=[])
+	population.run(random_fitness, 1, 2)
+	path = str(tmp_path / 'population.ckpt')
+	population.save_checkpoint(path)
+	loaded = Population.load_checkpoint(path, reporters=[])
+	assert (loaded.key, loaded.size, loaded.elitism, loaded.current_gen) == (
+		key, population.size, population.elitism, population.current_gen)
+	assert loaded.reproduction.next_genome_key == population.reproduction.next_genome_key
+	assert genome_state(loaded.best_genome) == genome_state(population.best_genome)
+	assert sorted(loaded.population) == sorted(population.population)
+	for gid, genome in iteritems(population.population):
+		assert genome_state(loaded.population[gid]) == genome_state(genome)
+
+def test_unstorable_key_keeps_previous_checkpoint(tmp_path):
+	random.seed(8)
+	np.random.seed(8)
+	population = Population(1, 10, 1, reporters=[])
+	path = str(tmp_path / 'population.ckpt')
+	population.save_checkpoint(path)
+	with open(path, 'rb') as f:
+		saved = f.read()
+	population.key = ('xor', 1)
+	with pytest.raises(GenomeCodecError):
+		population.save_checkpoint(path)
+	assert os.listdir(str(tmp_path)) == ['population.ckpt']
+	with open(path, 'rb') as f:
+		assert f.read() == saved
@@ -0,0 +1,36 @@
+'''
+Checks the batched weight mutation and its effect on copy-on-write clones.
+'''
+import random
+import numpy as np
+from deep_hyperneat.genome import (Genome, batch_mutate_weights, weight_mutation_rate,
+								   weight_mutation_power)
+from deep_hyperneat.util import iteritems
+
+def weights(genome):
+	return {key:conn.weight for key, conn in iteritems(genome.connections)}
+
+def test_batch_mutate_weights_perturbs_offspring_only():
+	random.seed(9)
+	np.random.seed(9)
+	parents = []
+	for key in range(1, 41):
+		parent = Genome(key).clone(key)
+		for _ in range(10):
+			parent.mutate()
+		parents.append(parent)
+	parent_weights = [weights(parent) for parent in parents]
+	offspring = [parent.clone(100+i, 1) for i, parent in enumerate(parents)]
+	batch_mutate_weights(offspring)
+	deltas = [child.connections[key].weight - weight
+			  for child, before in zip(offspring, parent_weights) for key, weight in iteritems(before)]
+	assert len(deltas) > 500
+	perturbed = [delta for delta in deltas if delta != 0.0]
+	assert abs(len(perturbed)/len(deltas) - weight_mutation_rate) < 0.05
+	# Deltas are read back from the weights, so allow for rounding
+	assert all(abs(delta) <= weight_mutation_power + 1e-12 for delta in perturbed)
+	# Clones share unmutated genes, but writes go to their own copies
+	assert [weights(parent) for parent in parents] == parent_weights
+	assert any(child.connections[key] is parent.connections[key]
+			   for child, parent in zip(offspring, parents) for key in parent.connections
+			   if child.connections[key].weight == parent.connections[key].weight)
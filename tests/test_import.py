@@ -0,0 +1,45 @@
+'''
+Guards the startup time of the core package. Worker processes import these
+modules to evaluate genomes, so they must stay free of the plotting
+libraries and import quickly.
+'''
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+plotting_modules = ['matplotlib', 'seaborn', 'graphviz']
+# Seconds allowed for an import, over ten times the usual cost (most of which
+#	is numpy). Loading the plotting libraries alone takes close to a second.
+max_import_time = 1.0
+# Each module is imported this many times, and the fastest import is checked
+repeat = 3
+import_script = '''
+import sys, json, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {plotting!r} if m in sys.modules]]))
+'''
+
+def import_in_subprocess(module):
+	'''
+	Imports a module in a fresh interpreter and returns the seconds taken and
+	the plotting modules it loaded.
+
+	module -- name of the module to import
+	'''
+	script = import_script.format(root=root, module=module, plotting=plotting_modules)
+	return json.loads(subprocess.check_output([sys.executable, '-c', script]))
+
+@pytest.mark.parametrize('module', ['deep_hyperneat.population', 'deep_hyperneat.parallel',
+									'deep_hyperneat.tasks'])
+def test_import_is_fast_and_headless(module):
+	results = [import_in_subprocess(module) for _ in range(repeat)]
+	for _, loaded in results:
+		assert loaded == [], "importing {0} loads {1}".format(module, ", ".join(loaded))
+	elapsed = min(elapsed for elapsed, _ in results)
+	assert elapsed < max_import_time, "importing {0} took {1:.2f}s".format(module, elapsed)
@@ -0,0 +1,54 @@
+'''
+Checks migration between islands and a seeded island run.
+'''
+from deep_hyperneat.islands import IslandModel, ring_topology
+from deep_hyperneat.parallel import ParallelEvaluator
+from deep_hyperneat.tasks import SupervisedTask
+
+xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
+xor_outputs = [0.0,1.0,1.0,0.0]
+
+class FakeIsland:
+	# Island end of a pipe that answers commands without running a population
+	def __init__(self, key):
+		self.key = key
+		self.immigrants = None
+		self.replies = []
+
+	def send(self, message):
+		command, args = message
+		if command == 'emigrants':
+			self.replies.append(('ok', ['{0}-{1}'.format(self.key, i) for i in range(args[0])]))
+		elif command == 'immigrants':
+			self.immigrants = args[0]
+			self.replies.append(('ok', None))
+
+	def recv(self):
+		return self.replies.pop(0)
+
+def test_ring_migration_sends_emigrants_to_next_island():
+	assert ring_topology(3) == [[1], [2], [0]]
+	model = IslandModel(3, 10, num_migrants=2)
+	islands = [FakeIsland(i) for i in range(3)]
+	model.migrate(islands)
+	assert [island.immigrants for island in islands] == [['2-0', '2-1'], ['0-0', '0-1'], ['1-0', '1-1']]
+
+def run_islands(num_migrants):
+	task = ParallelEvaluator(SupervisedTask(xor_inputs, xor_outputs, [1,2], 1, [1,3],
+											cache=False).evaluate, num_workers=2)
+	model = IslandModel(2, 10, topology='ring', migration_interval=2,
+						num_migrants=num_migrants, seed=5)
+	best_genome = model.run(task, 4.0, 6)
+	return model, best_genome
+
+def test_seeded_ring_run_with_parallel_evaluator():
+	model, best_genome = run_islands(num_migrants=2)
+	assert [stats['generation'] for stats in model.history] == [2, 4, 6]
+	assert best_genome.fitness == max(max(stats['island_best_fitness']) for stats in model.history)
+	# Islands are seeded, so a second run repeats the first
+	again, _ = run_islands(num_migrants=2)
+	assert again.history == model.history
+	# and migrants change how the islands evolve after the first interval
+	isolated, _ = run_islands(num_migrants=0)
+	assert isolated.history[0] == model.history[0]
+	assert isolated.history[1:] != model.history[1:]
@@ -0,0 +1,32 @@
+'''
+Checks the trace written by a profiled run.
+'''
+import json
+import random
+import numpy as np
+import pytest
+from deep_hyperneat.population import Population
+from deep_hyperneat.profiling import profiler
+from deep_hyperneat.tasks import SupervisedTask
+
+xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
+xor_outputs = [0.0,1.0,1.0,0.0]
+
+def test_interrupted_run_writes_trace(tmp_path):
+	random.seed(10)
+	np.random.seed(10)
+	supervised = SupervisedTask(xor_inputs, xor_outputs, [1,2], 1, [1,3], cache=False)
+	calls = []
+	def task(genomes):
+		calls.append(len(genomes))
+		if len(calls) == 2:
+			raise KeyboardInterrupt
+		supervised(genomes)
+	path = str(tmp_path / 'trace.jsonl')
+	population = Population(1, 10, 1, reporters=[])
+	with pytest.raises(KeyboardInterrupt):
+		population.run(task, 4.0, 5, trace_path=path)
+	assert not profiler.enabled
+	with open(path) as f:
+		names = {json.loads(line)['name'] for line in f}
+	assert {'decode', 'create_substrate', 'query_cppn'} <= names
@@ -0,0 +1,123 @@
+'''
+Checks that SpeciesSet.speciate partitions populations exactly like the
+original implementation, which rebuilt every species after each genome
+was assigned.
+'''
+import random
+import numpy as np
+import pytest
+from itertools import count
+from deep_hyperneat.reproduction import Reproduction
+from deep_hyperneat.species import Species, SpeciesSet, GenomeDistanceCache
+from deep_hyperneat.util import iteritems, iterkeys, itervalues
+
+class ReferenceSpeciesSet:
+	# Speciation as implemented before membership was updated incrementally
+	def __init__(self, threshold):
+		self.threshold = threshold
+		self.species = {}
+		self.species_indexer = count(1)
+		self.genome_to_species = {}
+
+	def speciate(self, population, generation):
+		compatibility_threshold = self.threshold
+		unspeciated = set(iterkeys(population))
+		# Scalar distances, cached for this call only
+		scalar_distance = GenomeDistanceCache().genome_distance
+		cached = {}
+		def distance(genome0, genome1):
+			key = (genome0.key, genome1.key)
+			if key not in cached:
+				cached[key] = cached[key[::-1]] = scalar_distance(genome0, genome1)
+			return cached[key]
+		new_representatives = {}
+		new_members = {}
+		for sid, species in iteritems(self.species):
+			candidates = [population[gid] for gid in unspeciated]
+			_, new_rep = min(((distance(species.representative, genome), genome) for genome in candidates),
+							 key=lambda x: x[0])
+			new_rid = new_rep.key
+			new_representatives[sid] = new_rid
+			new_members[sid] = [new_rid]
+			unspeciated.remove(new_rid)
+		while unspeciated:
+			gid = unspeciated.pop()
+			genome = population[gid]
+			candidate_species = []
+			for sid, rid in iteritems(new_representatives):
+				genome_distance = distance(genome, population[rid])
+				if genome_distance < compatibility_threshold:
+					candidate_species.append((genome_distance, sid))
+			if candidate_species:
+				_, sid = min(candidate_species, key=lambda x: x[0])
+				new_members[sid].append(gid)
+			else:
+				sid = next(self.species_indexer)
+				new_representatives[sid] = gid
+				new_members[sid] = [gid]
+			# Rebuild every species after each assignment
+			self.genome_to_species = {}
+			for sid, rid in iteritems(new_representatives):
+				s = self.species.get(sid)
+				if s is None:
+					s = Species(sid, generation)
+					self.species[sid] = s
+				members = new_members[sid]
+				for gid in members:
+					self.genome_to_species[gid] = sid
+				s.update(population[rid], {gid:population[gid] for gid in members})
+
+def partition(species_set):
+	'''
+	Returns the species ids, creation generations, representatives and
+	members of a species set, and its genome to species map.
+	'''
+	species = sorted((sid, s.created, s.representative.key, sorted(s.members))
+					 for sid, s in iteritems(species_set.species))
+	return species, sorted(species_set.genome_to_species.items())
+
+def generations(seed, size=120):
+	'''
+	Returns two consecutive fixed-seed populations. The second keeps half of
+	the first and fills up with mutated clones of it.
+	'''
+	random.seed(seed)
+	np.random.seed(seed)
+	reproduction = Reproduction()
+	first = {}
+	for key, genome in iteritems(reproduction.create_new_population(size)):
+		# Mutate clones, as reproduction does
+		first[key] = genome.clone(key, 0)
+		for _ in range(random.randint(0, 12)):
+			first[key].mutate()
+	survivors = random.sample(sorted(first), size//2)
+	second = {key:first[key] for key in survivors}
+	for key in range(size+1, 2*size+1-len(second)):
+		child = first[random.choice(survivors)].clone(key, 1)
+		for _ in range(random.randint(1, 4)):
+			child.mutate()
+		second[key] = child
+	return first, second
+
+@pytest.mark.parametrize('threshold', [0.5, 1.0, 1.5, 2.0])
+def test_speciate_matches_reference(threshold):
+	populations = generations(seed=11)
+	species_set = SpeciesSet(threshold)
+	reference = ReferenceSpeciesSet(threshold)
+	for generation, population in enumerate(populations):
+		species_set.speciate(population, generation)
+		reference.speciate(population, generation)
+		assert partition(species_set) == partition(reference)
+		assert len(species_set.genome_to_species) == len(population)
+
+def test_distance_cache_evicts_least_recently_used_pairs():
+	first, _ = generations(seed=5, size=4)
+	a, b, c, d = (first[key] for key in sorted(first))
+	distances = GenomeDistanceCache(max_distances=2)
+	distances(a, b)
+	distances.distances_to(a, [c])
+	# Using the oldest pair keeps it over the newer one
+	assert distances.distances_to(a, [b]) == [distances(b, a)]
+	distances(c, d)
+	assert set(distances.distances) == {(a.key, b.key), (b.key, a.key), (c.key, d.key), (d.key, c.key)}
+	assert distances.evictions == 1
@@ -0,0 +1,43 @@
+'''
+Checks that SupervisedTask scores genomes like the per-case evaluation loop
+it replaced.
+'''
+import random
+import numpy as np
+import pytest
+from deep_hyperneat.genome import Genome
+from deep_hyperneat.phenomes import FeedForwardCPPN
+from deep_hyperneat.decode import decode
+from deep_hyperneat.cache import PhenotypeCache
+from deep_hyperneat.tasks import SupervisedTask
+
+xor_inputs = [(0.0,0.0),(0.0,1.0),(1.0,0.0),(1.0,1.0)]
+xor_outputs = [0.0,1.0,1.0,0.0]
+
+def reference_fitness(genome):
+	# Fitness as computed by the original XOR task, one case at a time
+	substrate = decode(FeedForwardCPPN.create(genome), [1,2], 1, [1,3])
+	sum_square_error = 0.0
+	for inputs, expected in zip(xor_inputs, xor_outputs):
+		output = substrate.activate(inputs + (1.0,))[0]
+		sum_square_error += ((output - expected)**2)/len(xor_inputs)
+	return 1.0 - sum_square_error
+
+@pytest.mark.parametrize('cache', [False, True, 'own'])
+def test_fitness_matches_per_case_loop(cache):
+	random.seed(12)
+	np.random.seed(12)
+	if cache == 'own':
+		cache = PhenotypeCache()
+	task = SupervisedTask(xor_inputs, xor_outputs, [1,2], 1, [1,3], cache=cache)
+	for key in range(1, 11):
+		genome = Genome(key).clone(key)
+		for _ in range(key):
+			genome.mutate()
+		expected = reference_fitness(genome)
+		# The second evaluation reads the substrate from the cache, if any
+		for _ in range(2):
+			task([(key, genome)])
+			assert genome.fitness == pytest.approx(expected, abs=1e-12)
+	if task.phenotype_cache is not None:
+		assert task.phenotype_cache.hits >= 10